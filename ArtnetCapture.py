@@ -0,0 +1,291 @@
+"""
+ArtnetCapture.py - Records the DMX data the router receives to a capture file, and plays it back.
+
+A capture is two append-only files:
+- the data file, a short header followed by the DMX data of every packet, back to back.
+- the index file (data file name + ".idx"), a short header followed by one fixed size
+  record per packet: arrival time in ns since the start of the capture, offset and length
+  of its data in the data file, and Port-Address.  ArtSync (and sACN synchronization)
+  packets are recorded with Port-Address SYNC_ADDRESS and no data.
+
+Both files are memory mapped for playback, so the index can be searched by time or
+Port-Address without reading the whole capture, and packet data is handed to the
+dispatcher without being copied.
+
+Usage: python ArtnetCapture.py info <capture file>
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ArtnetCapture:
+    """File format constants shared by the recorder and player"""
+    DATA_MAGIC = b'FCCAPDAT'
+    INDEX_MAGIC = b'FCCAPIDX'
+    VERSION = 1
+    HEADER = struct.Struct('<8sId')  # magic, version, capture start time (time.time())
+    HEADER_SIZE = 32
+    INDEX_RECORD = struct.Struct('<qQHHI')  # time (ns), data offset, Port-Address, length, reserved
+    SYNC_ADDRESS = 0xFFFF
+
+    if np is not None:
+        INDEX_DTYPE = np.dtype([('time', '<i8'), ('offset', '<u8'), ('addr', '<u2'), ('length', '<u2'),
+                                ('reserved', '<u4')])
+
+    @staticmethod
+    def indexFileName(fileName: str) -> str:
+        return fileName + ".idx"
+
+
+class CaptureRecorder(ArtnetCapture):
+    """
+    Appends packets to a capture.  Safe to share between receivers running in different threads.
+    """
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, fileName: str, append: bool = False):
+        """
+        :param fileName: capture data file name
+        :param append: if True and the capture exists, add to the end of it.  Recording picks up
+        right where the capture left off, so there's no gap when it's played back.
+        """
+        self.fileName = fileName
+        self.offset = self.HEADER_SIZE
+        self.start = time.perf_counter_ns()
+        self.packets = 0
+        self.lock = threading.Lock()
+
+        player = None
+        if append and os.path.exists(fileName) and os.path.exists(self.indexFileName(fileName)):
+            try:
+                player = CapturePlayer(fileName)
+            except ValueError as e:
+                # it's not a capture we can add to, so move it out of the way, and start a new one
+                logging.warning("%s, starting a new capture.  The old one is saved as %s.bad" % (str(e), fileName))
+                os.replace(fileName, fileName + ".bad")
+                os.replace(self.indexFileName(fileName), self.indexFileName(fileName + ".bad"))
+
+        if player is not None:
+            self.offset = self.HEADER_SIZE + sum(player.lengths)
+            if player.count > 0:
+                self.start -= player.times[-1]
+            indexSize = self.HEADER_SIZE + player.count * self.INDEX_RECORD.size
+            player.close()
+            # drop anything a crash left half written, then carry on
+            os.truncate(fileName, self.offset)
+            os.truncate(self.indexFileName(fileName), indexSize)
+            self.data = open(fileName, "ab", buffering=self.BUFFER_SIZE)
+            self.index = open(self.indexFileName(fileName), "ab", buffering=self.BUFFER_SIZE)
+            return
+
+        self.data = open(fileName, "wb", buffering=self.BUFFER_SIZE)
+        self.index = open(self.indexFileName(fileName), "wb", buffering=self.BUFFER_SIZE)
+        header = self.HEADER.pack(self.DATA_MAGIC, self.VERSION, time.time()).ljust(self.HEADER_SIZE, b'\x00')
+        self.data.write(header)
+        self.index.write(self.INDEX_MAGIC + header[8:])
+
+    def record(self, addr: int, data):
+        """
+        Append a packet's DMX data to the capture
+        :param addr: Port-Address
+        :param data: DMX data
+        """
+        n = len(data)
+        with self.lock:
+            if self.data is None:
+                return
+            self.data.write(data)
+            self.index.write(self.INDEX_RECORD.pack(time.perf_counter_ns() - self.start, self.offset, addr, n, 0))
+            self.offset += n
+            self.packets += 1
+
+    def recordBatch(self, batch: list):
+        """Append a batch of (addr, data) packets, all stamped with the same time"""
+        with self.lock:
+            if self.data is None:
+                return
+            t = time.perf_counter_ns() - self.start
+            for addr, data in batch:
+                n = len(data)
+                self.data.write(data)
+                self.index.write(self.INDEX_RECORD.pack(t, self.offset, addr, n, 0))
+                self.offset += n
+            self.packets += len(batch)
+
+    def recordSync(self):
+        self.record(self.SYNC_ADDRESS, b'')
+
+    def close(self):
+        with self.lock:
+            if self.data is None:
+                return
+            self.data.close()
+            self.index.close()
+            self.data = None
+            self.index = None
+
+
+class CapturePlayer(ArtnetCapture):
+    """
+    Plays a capture back through a dispatcher, at real time, faster or slower, or as fast as possible.
+    """
+
+    def __init__(self, fileName: str):
+        self.fileName = fileName
+        self.dataFile = open(fileName, "rb")
+        self.indexFile = open(self.indexFileName(fileName), "rb")
+        if min(os.fstat(f.fileno()).st_size for f in (self.dataFile, self.indexFile)) < self.HEADER_SIZE:
+            self.dataFile.close()
+            self.indexFile.close()
+            raise ValueError("%s is empty or truncated" % fileName)
+        self.dataMap = mmap.mmap(self.dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.indexMap = mmap.mmap(self.indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.startTime = self.HEADER.unpack_from(self.dataMap)
+        if magic != self.DATA_MAGIC or self.indexMap[:8] != self.INDEX_MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError("%s is not a Flamecaster capture" % fileName)
+        self.view = memoryview(self.dataMap)
+
+        # ignore a partly written record at the end of the index, and any records whose
+        # data didn't make it to the disk, in case the recorder didn't shut down cleanly.
+        count = (len(self.indexMap) - self.HEADER_SIZE) // self.INDEX_RECORD.size
+        if np is not None:
+            self.records = np.frombuffer(self.indexMap, dtype=self.INDEX_DTYPE, count=count, offset=self.HEADER_SIZE)
+            valid = self.records['offset'] + self.records['length'] <= len(self.dataMap)
+            count = int(np.argmin(valid)) if not valid.all() else count
+            self.records = self.records[:count]
+            self.times = self.records['time'].tolist()
+            self.offsets = self.records['offset'].tolist()
+            self.addrs = self.records['addr'].tolist()
+            self.lengths = self.records['length'].tolist()
+        else:
+            self.records = None
+            self.times, self.offsets, self.addrs, self.lengths = [], [], [], []
+            for t, offset, addr, n, _ in self.INDEX_RECORD.iter_unpack(
+                    self.indexMap[self.HEADER_SIZE:self.HEADER_SIZE + count * self.INDEX_RECORD.size]):
+                if offset + n > len(self.dataMap):
+                    break
+                self.times.append(t)
+                self.offsets.append(offset)
+                self.addrs.append(addr)
+                self.lengths.append(n)
+        self.count = len(self.times)
+        self.duration = self.times[-1] / 1e9 if self.count else 0.0
+
+    def seek(self, seconds: float) -> int:
+        """Return the index of the first packet at or after the given time into the capture"""
+        t = int(seconds * 1e9)
+        if np is not None:
+            return int(np.searchsorted(self.records['time'], t))
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def packetsFor(self, addr: int) -> list:
+        """Return the indices of all the packets on a Port-Address"""
+        if np is not None:
+            return np.flatnonzero(self.records['addr'] == addr).tolist()
+        return [i for i, a in enumerate(self.addrs) if a == addr]
+
+    def packet(self, i: int):
+        """Return (time in seconds, Port-Address, data) for packet i.  Data is a view into the capture."""
+        offset = self.offsets[i]
+        return self.times[i] / 1e9, self.addrs[i], self.view[offset:offset + self.lengths[i]]
+
+    def summary(self) -> dict:
+        addresses = dict()
+        for addr in self.addrs:
+            addresses[addr] = addresses.get(addr, 0) + 1
+        syncs = addresses.pop(self.SYNC_ADDRESS, 0)
+        return {"file": self.fileName, "recorded": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.startTime)),
+                "seconds": round(self.duration, 3), "packets": self.count - syncs, "syncs": syncs,
+                "bytes": len(self.dataMap) - self.HEADER_SIZE,
+                "addresses": {str(addr): addresses[addr] for addr in sorted(addresses)}}
+
+    def play(self, callback, syncCallback=None, speed: float = 1.0, loop: bool = False, stopFlag=None,
+             clock=None, start: float = 0.0):
+        """
+        Play the capture, calling callback(addr, data) for each packet in turn, at the time it arrived
+        :param callback: packet dispatcher, like ArtnetRouter.main_dispatcher
+        :param syncCallback: called for ArtSync packets
+        :param speed: playback speed.  1 is real time, 2 is twice as fast, 0 is as fast as possible
+        :param loop: if True, start again from the beginning at the end of the capture
+        :param stopFlag: Event that stops playback when set
+        :param clock: if given, its receiveTime is set to the perf_counter() time each packet is dispatched
+        :param start: time into the capture to start playing from, in seconds
+        :return: number of packets played
+        """
+        times, offsets, addrs, lengths = self.times, self.offsets, self.addrs, self.lengths
+        view = self.view
+        sync = self.SYNC_ADDRESS
+        first = self.seek(start)
+        played = 0
+        while self.count > 0:
+            t0 = time.perf_counter() - (times[first] / 1e9 / speed if speed > 0 else 0)
+            for i in range(first, self.count):
+                if speed > 0:
+                    d = t0 + times[i] / 1e9 / speed - time.perf_counter()
+                    if d > 0:
+                        time.sleep(d)
+                if stopFlag is not None and stopFlag.is_set():
+                    return played
+                if clock is not None:
+                    clock.receiveTime = time.perf_counter()
+                if addrs[i] == sync:
+                    if syncCallback is not None:
+                        syncCallback()
+                else:
+                    callback(addrs[i], view[offsets[i]:offsets[i] + lengths[i]])
+                played += 1
+            if not loop:
+                break
+            first = 0
+        return played
+
+    def close(self):
+        # views handed out during playback may still be around, in which case we leave
+        # the maps for the garbage collector.
+        self.records = None
+        if getattr(self, "view", None) is not None:
+            self.view.release()
+        for m in (self.dataMap, self.indexMap):
+            try:
+                m.close()
+            except BufferError:
+                pass
+        self.dataFile.close()
+        self.indexFile.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("info",), help="What to do with the capture")
+    parser.add_argument("file", help="Capture file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        parser.error("capture file %s not found" % args.file)
+    player = CapturePlayer(args.file)
+    print(json.dumps(player.summary(), indent=2))
+    player.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,21 @@
+import json
 import logging
+import queue
 import time
 import socket
+import threading
 
+from ArtnetCapture import CapturePlayer, CaptureRecorder
 from ArtnetServer import ArtnetServer
 from ArtnetUtils import time_in_millis, decode_address_int
+from SacnServer import SacnServer
+from ShowPlayer import ShowPlayer
+from SourceArbiter import SourceArbiter
 from ConfigParser import ConfigParser
+from DisplayDevice import FrameStore, SharedFrameBuffer
+from Metrics import MetricsServer, formatMetric
+from StatsTable import StatsTable
+from OutputScheduler import OutputScheduler
 from ProjectData import ProjectData
 
 
@@ -14,6 +25,16 @@ class ArtnetRouter:
     process, and communicate with the main process via Queues.
     """
     receiver = None
+    sacnReceiver = None
+    arbiter = None
+    recorder = None
+    player = None
+    showPlayer = None
+    receivers = []
+    receiveTime = 0.0
+    scheduler = None
+    metricsServer = None
+    frameBuffers = []
     pixelsPerUniverse = 170
     pixelCount = 0
     dataReady = False
@@ -24,6 +45,7 @@ class ArtnetRouter:
 
     config = None
     universes = []
+    dispatchTable = dict()
     deviceList = None
     pollReplyPacket = None
 
@@ -36,43 +58,170 @@ class ArtnetRouter:
             datefmt='%Y-%m-%d %H:%M:%S')
 
         self.pd = pd
-        self.dataQueue = pd.dataQueue
+        self.statsTable = StatsTable(name=pd.statsTableName)
         self.ui_is_active = pd.ui_is_active
         self.exit_flag = pd.exit_flag
+        self.cmdQueue = pd.cmdQueue
 
-        jim = ConfigParser()
-        self.config, self.deviceList, self.universes = jim.parse(pd.liveConfig)
+        # frame stores we've attached to, keyed by device key
+        self.frameStores = dict()
+
+        # held while the status loop folds the interval counters into their totals, so
+        # the metrics endpoint never sees a count twice, or not at all.  The packet and
+        # output paths never take it.
+        self.statsLock = threading.Lock()
+
+        # In sharded mode, output worker processes send the frames, and we just
+        # decode incoming data into the devices' shared frame buffers.
+        sharded = len(pd.frameBufferNames) > 0
+
+        self.parser = ConfigParser()
+        self.config, self.deviceList, self.universes, self.dispatchTable = self.parser.parse(pd.liveConfig,
+                                                                                             startOutput=not sharded)
+        self.attachFrameStores(pd.frameStoreNames)
+        if sharded:
+            self.attachFrameBuffers(pd.frameBufferNames)
+
+        # by default, each device runs its own output thread.  The asyncio output engine
+        # runs them all from a single event loop instead.
+        elif self.config['outputEngine'] == "asyncio":
+            self.scheduler = OutputScheduler(self.deviceList)
+            self.scheduler.start()
 
-        if self.config['ipArtnet'] == "0.0.0.0":
-            print("Listening for Art-Net on all interfaces at port %s" % self.config['portArtnet'])
-        else:
-            print("Listening for Art-Net on %s:%s" % (self.config['ipArtnet'], self.config['portArtnet']))
         self.notifyTimer = time_in_millis()
+        self.lastPacketCount = 0
 
         # loop 'till we're done, listening for packets and forwarding the pixel data
-        # to Pixelblazes
-        self.pollReplyPacket = self.createPollReplyPacket(self.config['ipArtnet'], self.config['portArtnet'])
-        self.receiver = ArtnetServer(self.config["ipArtnet"], self.config["portArtnet"], self.pollReplyPacket,
-                                     self.main_dispatcher)
+        # to Pixelblazes.  There's one receiver (and socket, and thread) per listen address,
+        # all feeding the same dispatch table.
+        # receive modes are "simple" (copy each packet), "zerocopy" (one packet at a time, no copies)
+        # and "batch" (zero-copy, and drain all pending packets at once).
+        # When we're playing a recorded show, there's no network input at all.
+        receiveMode = self.config['receiveMode']
+        listeners = [] if pd.playFile else ConfigParser.getArtnetListeners(self.config)
+        self.receivers = []
+
+        # if we've been asked to, record everything we receive to a capture file.  We append,
+        # so the recording carries on if the router is restarted.
+        if pd.recordFile:
+            try:
+                self.recorder = CaptureRecorder(pd.recordFile, append=True)
+                print("Recording to %s" % pd.recordFile)
+            except (OSError, ValueError) as e:
+                logging.error("Unable to record to %s: %s" % (pd.recordFile, str(e)))
+
+        # when several controllers send the same universes, the source arbiter filters out unknown
+        # senders, and handles failover or merging.  It's shared by all the Art-Net receivers, since
+        # primary and backup consoles may well be on different interfaces.
+        if self.config['sourcePolicy'] != "any" or self.config['allowedSources']:
+            self.arbiter = SourceArbiter(self.config['sourcePolicy'], self.config['allowedSources'],
+                                         self.config['primarySource'], self.config['sourceTimeoutMs'])
+        for ip, port, interface in listeners:
+            if interface:
+                print("Listening for Art-Net on interface %s at port %s" % (interface, port))
+            elif ip == "0.0.0.0":
+                print("Listening for Art-Net on all interfaces at port %s" % port)
+            else:
+                print("Listening for Art-Net on %s:%s" % (ip, port))
+            self.receivers.append(
+                ArtnetServer(ip, port, self.createPollReplyPacket(ip, port),
+                             self.main_dispatcher, zeroCopy=(receiveMode != "simple"),
+                             batchCallback=self.batch_dispatcher if receiveMode == "batch" else None,
+                             sequenceWindow=self.config['sequenceWindow'],
+                             syncCallback=self.sync_dispatcher, clock=self,
+                             reusePort=listeners.count((ip, port, interface)) > 1, arbiter=self.arbiter,
+                             recorder=self.recorder, interface=interface))
+        if self.receivers:
+            self.receiver = self.receivers[0]
+            self.pollReplyPacket = self.receiver.pollReplyPacket
+
+        # sACN, if enabled, feeds the same dispatch table.  Its universes are mapped onto
+        # Port-Addresses, so devices don't care which protocol their data arrives on.
+        if self.config['sacnEnabled'] and not pd.playFile:
+            try:
+                self.sacnReceiver = SacnServer(self.config['ipSacn'], self.getSacnUniverses(), self.main_dispatcher,
+                                               batchCallback=self.batch_dispatcher if receiveMode == "batch" else None,
+                                               syncCallback=self.sync_dispatcher,
+                                               universeOffset=self.config['sacnUniverseOffset'], clock=self,
+                                               recorder=self.recorder)
+                self.receivers.append(self.sacnReceiver)
+                print("Listening for sACN on universes %s" % sorted(self.sacnReceiver.universes))
+            except OSError as e:
+                logging.error("Unable to start sACN receiver: " + str(e))
+
+        # a capture can be replayed through the dispatcher too, as if a console were sending it
+        if pd.replayFile:
+            try:
+                self.player = CapturePlayer(pd.replayFile)
+                threading.Thread(target=self.replay, args=(pd.replaySpeed,), daemon=True).start()
+            except (OSError, ValueError) as e:
+                logging.error("Unable to replay %s: %s" % (pd.replayFile, str(e)))
+
+        # standalone show playback drives the devices straight from a capture
+        if pd.playFile:
+            try:
+                self.showPlayer = ShowPlayer(pd.playFile, self, speed=pd.replaySpeed, loop=pd.playLoop)
+                self.showPlayer.start()
+            except (OSError, ValueError) as e:
+                logging.error("Unable to play %s: %s" % (pd.playFile, str(e)))
+
+        # all receivers stamp packet arrival times on our receiveTime
+        for key in self.deviceList:
+            self.deviceList[key].receiveClock = self
+
+        # metrics are served on the web interface's address, unless "ipMetrics" says otherwise
+        if self.config['metricsPort'] > 0:
+            metricsIp = self.config['ipMetrics'] or self.config['ipWebInterface']
+            try:
+                self.metricsServer = MetricsServer(metricsIp, self.config['metricsPort'], self.getMetricsText)
+                self.metricsServer.start()
+                logging.info("Serving metrics at http://%s:%d/metrics" % (metricsIp, self.config['metricsPort']))
+            except OSError as e:
+                logging.error("Unable to start metrics server: " + str(e))
         sleep_time = self.config['statusUpdateIntervalMs'] / 1000
 
-        # Periodically send updated status information to the UI queue, where
+        # Periodically write updated status information to the shared stats table, where
         # the WebUI can display it if anybody's watching.  We try to keep
         # this thread asleep as much as possible so the other threads in
-        # this process can deal with moving the data around.
+        # this process can deal with moving the data around.  While we wait
+        # for the next update, we watch the command queue, so configuration
+        # changes from the UI are applied right away.
+        nextStatus = time.monotonic() + sleep_time
         while True:
             try:
                 if self.exit_flag.is_set():
                     break
 
-                time.sleep(sleep_time)
+                try:
+                    self.handleCommand(self.cmdQueue.get(timeout=max(0.0, nextStatus - time.monotonic())))
+                    continue
+                except queue.Empty:
+                    pass
+
+                nextStatus += sleep_time
                 elapsedTime = time_in_millis() - self.notifyTimer
 
-                for key in self.deviceList:
-                    dd = self.deviceList[key]
-                    if self.ui_is_active.is_set():
-                        self.dataQueue.put(dd.getStatusString(elapsedTime / 1000))
-                    dd.resetCounters()
+                if self.config['latencyLogFile']:
+                    self.writeLatencyLog(self.config['latencyLogFile'])
+
+                with self.statsLock:
+                    for row, key in enumerate(self.deviceList):
+                        dd = self.deviceList[key]
+                        dd.packets_lost, dd.packets_stale = self.getSequenceStats(dd.addresses)
+                        self.statsTable.writeRow(row, dd.getStatus(elapsedTime / 1000))
+                        dd.resetCounters()
+
+                batchSizes = dict()
+                packetCount = 0
+                for receiver in self.receivers:
+                    receiver.resetSequenceStats()
+                    packetCount += receiver.packetCount
+                    for n, count in receiver.resetBatchSizes().items():
+                        batchSizes[n] = batchSizes.get(n, 0) + count
+                self.statsTable.setRouterStatus(self.getRouterStatus(elapsedTime / 1000,
+                                                                     packetCount - self.lastPacketCount, batchSizes))
+                self.lastPacketCount = packetCount
+                self.statsTable.publish(len(self.deviceList))
 
                 self.notifyTimer = time_in_millis()
 
@@ -93,27 +242,266 @@ class ArtnetRouter:
         self.notify_ms = max(500, ms)  # min interval is 1/2 second, default should be about 3 sec
 
     def shutdown(self):
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+
+        if self.showPlayer is not None:
+            logging.debug("Stopping show playback")
+            self.showPlayer.stop()
+
+        if self.scheduler is not None:
+            logging.debug("Stopping output scheduler")
+            self.scheduler.stop()
+
         # stop all devices in DeviceList
         for key in self.deviceList:
             logging.info("Stopping device: " + self.deviceList[key].name)
             self.deviceList[key].stop()
 
         # stop listening for Artnet packets
-        logging.debug("Stopping Artnet receiver thread")
-        del self.receiver
+        logging.debug("Stopping Artnet receiver threads")
+        for receiver in self.receivers:
+            receiver.close()
+        self.receivers = []
+        self.sacnReceiver = None
+        self.receiver = None
+        if self.recorder is not None:
+            self.recorder.close()
+
+        for shared in self.frameBuffers:
+            shared.close()
+        for key in self.frameStores:
+            self.frameStores[key].close()
+        self.statsTable.close()
+
+    def attachFrameStores(self, storeNames: dict):
+        """
+        Have each device publish its complete frames to its shared memory frame store
+        :param storeNames: dictionary of frame store names, keyed by device key
+        """
+        for key in storeNames:
+            if key in self.deviceList:
+                store = FrameStore(name=storeNames[key])
+                self.deviceList[key].attachFrameStore(store)
+                self.frameStores[key] = store
+
+    def handleCommand(self, cmd: dict):
+        """
+        Process a command from the main process
+        :param cmd: command dictionary.  The "cmd" key says what to do.
+        """
+        if cmd.get("cmd") == "reconfigure":
+            self.reconfigure(cmd["config"], cmd.get("frameStores", dict()))
+        else:
+            logging.warning("ArtnetRouter: unknown command %s" % str(cmd.get("cmd")))
+
+    def reconfigure(self, config: dict, storeNames: dict):
+        """
+        Apply a configuration change while we're running.  Only the objects affected by the
+        change are rebuilt - everybody else keeps their Pixelblaze connection.  The new device
+        list and dispatch table are built on the side, then swapped in, so the receiver
+        thread always sees a consistent configuration.
+        :param config: the new configuration
+        :param storeNames: frame store names for rebuilt devices, keyed by device key
+        """
+        t = time.monotonic()
+        diff = ConfigParser.diff(self.parser.config, config)
+        if diff.systemChanged:
+            logging.warning("ArtnetRouter: system settings changes need a restart, and were not applied.")
+
+        removed, added = self.parser.applyDiff(config, diff, startOutput=self.scheduler is None)
+
+        # swap in the new configuration
+        self.deviceList = self.parser.deviceList
+        self.universes = self.parser.universes
+        self.dispatchTable = self.parser.dispatchTable
+
+        # then shut down the old devices, and start the new ones
+        for key in removed:
+            dd = removed[key]
+            logging.info("Stopping device: " + dd.name)
+            if self.scheduler is not None:
+                self.scheduler.removeDevice(key)
+            dd.stop()
+            store = self.frameStores.pop(key, None)
+            if store is not None:
+                dd.frameStore = None
+                store.close()
+        self.attachFrameStores(storeNames)
+        for key in added:
+            added[key].receiveClock = self
+        if self.sacnReceiver is not None:
+            self.sacnReceiver.setUniverses(self.getSacnUniverses())
+        if self.scheduler is not None:
+            for key in added:
+                self.scheduler.addDevice(key, added[key])
+
+        logging.info("Reconfigured (%s) in %.1f ms" % (str(diff), (time.monotonic() - t) * 1000))
+
+    def attachFrameBuffers(self, bufferNames: dict):
+        """
+        Attach each device to its shared frame buffer, so its frames can be sent by an output worker
+        :param bufferNames: dictionary of shared frame buffer names, keyed by device key
+        """
+        self.frameBuffers = []
+        for key in self.deviceList:
+            dd = self.deviceList[key]
+            shared = SharedFrameBuffer(len(dd.outputBuffer) * dd.outputBuffer.itemsize, bufferNames[key])
+            dd.attachSharedInput(shared)
+            self.frameBuffers.append(shared)
+
+    def replay(self, speed: float):
+        """
+        Play the capture file through the dispatcher.  Runs in its own thread.
+        :param speed: playback speed.  1 is real time, 0 is as fast as possible
+        """
+        print("Replaying %s (%.1f seconds) at %s" % (self.player.fileName, self.player.duration,
+                                                     "full speed" if speed <= 0 else "%gx" % speed))
+        t = time.perf_counter()
+        played = self.player.play(self.main_dispatcher, self.sync_dispatcher, speed=speed, stopFlag=self.exit_flag,
+                                  clock=self)
+        logging.info("Replay finished: %d packets in %.2f seconds" % (played, time.perf_counter() - t))
+
+    def getSacnUniverses(self) -> set:
+        """Return the sACN universe numbers that map to the Port-Addresses our devices listen to"""
+        offset = self.config['sacnUniverseOffset']
+        return {addr + offset for addr in self.dispatchTable}
+
+    def getSequenceStats(self, addresses) -> tuple:
+        """
+        Return the total number of (lost, stale) packets on a set of Port-Addresses, over all receivers
+        :param addresses: iterable of Port-Addresses
+        :return: (lost, stale) tuple
+        """
+        lost = stale = 0
+        for receiver in self.receivers:
+            l, s = receiver.getSequenceStats(addresses)
+            lost += l
+            stale += s
+        return lost, stale
 
     def main_dispatcher(self, addr, data):
         """Receives data from server callback and dispatches it to display devices."""
         # universe, subnet, net = decode_address_int(addr)
         # print("%d, subnet %d, net %d" % (universe, subnet, net))
 
-        # test against the universe fragments in universes and print any matches
-        for key in self.universes:
-            u = self.universes[key]
-            for k in u:
-                if k.address_mask == addr:
-                    # Art-Net datagram size - 512 bytes of data plus 60 bytes of header
-                    k.device.process_packet(data, k.startChannel, k.destIndex, k.pixelCount)
+        # look up the universe fragments listening on this address, and hand
+        # the data to each fragment's device.
+        fragments = self.dispatchTable.get(addr)
+        if fragments is None:
+            return
+
+        for handler, startChannel, destIndex, pixelCount, fragmentBit in fragments:
+            handler(data, startChannel, destIndex, pixelCount, fragmentBit)
+
+    def batch_dispatcher(self, packets):
+        """Receives a batch of (addr, data) packets from the server and dispatches them to display devices."""
+        table = self.dispatchTable
+        for addr, data in packets:
+            fragments = table.get(addr)
+            if fragments is not None:
+                for handler, startChannel, destIndex, pixelCount, fragmentBit in fragments:
+                    handler(data, startChannel, destIndex, pixelCount, fragmentBit)
+
+    def sync_dispatcher(self):
+        """Receives ArtSync notifications from the server and passes them on to display devices."""
+        deviceList = self.deviceList
+        for key in deviceList:
+            deviceList[key].sync()
+
+    def writeLatencyLog(self, fileName: str):
+        """
+        Append the latency histograms for every device, for the status interval that's just
+        ending, to a log file as a single line of JSON.
+        :param fileName: log file name
+        """
+        record = {"time": round(time.time(), 3),
+                  "devices": [self.deviceList[key].getLatencyHistograms() for key in self.deviceList]}
+        try:
+            with open(fileName, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logging.error("Unable to write latency log %s: %s" % (fileName, str(e)))
+
+    def getRouterStatus(self, et, packets: int, batchSizes: dict) -> dict:
+        """
+        Return a status dictionary for the router itself
+        :param et: elapsed time in seconds
+        :param packets: number of packets received, by all receivers, in that time
+        :param batchSizes: receive batch size distribution, as {batch size: number of batches}.
+        Empty unless we're receiving in batch mode.
+        :return: status dictionary
+        """
+        batches = sum(batchSizes.values())
+        batched = sum(n * count for n, count in batchSizes.items())
+        return {"inPps": round(packets / et, 1), "batches": batches,
+                "meanBatch": round(batched / batches, 2) if batches > 0 else 0,
+                "maxBatch": max(batchSizes, default=0),
+                "batchSizes": batchSizes}
+
+    def getMetricsText(self) -> str:
+        """
+        Return the router's and devices' counters and gauges in Prometheus text format.
+        Called from the metrics server's thread.
+        """
+        deviceList = self.deviceList
+        with self.statsLock:
+            devices = [(deviceList[key], deviceList[key].getMetrics()) for key in deviceList]
+        labels = [{"device": dd.name, "ip": dd.ip} for dd, _ in devices]
+
+        def perDevice(field, scale=1):
+            return [(lbl, m[field] * scale) for lbl, (_, m) in zip(labels, devices)]
+
+        try:
+            cmdDepth = self.cmdQueue.qsize()
+        except NotImplementedError:
+            cmdDepth = 0
+        packetsReceived = sum(receiver.packetCount for receiver in self.receivers)
+
+        families = [
+            ("flamecaster_packets_in_total", "counter", "Art-Net packets received for the device",
+             perDevice("packets_in")),
+            ("flamecaster_pixels_received_total", "counter", "Pixels received for the device",
+             perDevice("pixelsReceived")),
+            ("flamecaster_frames_sent_total", "counter", "Frames sent to the device", perDevice("packets_out")),
+            ("flamecaster_frames_skipped_total", "counter", "Output frames not sent because they repeated the last one",
+             perDevice("frames_skipped")),
+            ("flamecaster_packets_lost_total", "counter", "Art-Net packets missing from the sequence",
+             perDevice("packets_lost")),
+            ("flamecaster_packets_stale_total", "counter", "Art-Net packets dropped as out of order",
+             perDevice("packets_stale")),
+            ("flamecaster_bytes_sent_total", "counter", "Bytes of frame data sent to the device",
+             perDevice("bytes_out")),
+            ("flamecaster_encode_seconds_total", "counter", "Time spent encoding text frames",
+             perDevice("encodeSeconds")),
+            ("flamecaster_encodes_total", "counter", "Number of text frames encoded", perDevice("encodes")),
+            ("flamecaster_reconnects_total", "counter", "Times the device's connection was re-established",
+             perDevice("reconnects")),
+            ("flamecaster_connected", "gauge", "1 if the device is connected", perDevice("connected")),
+            ("flamecaster_latency_p99_seconds", "gauge",
+             "99th percentile Art-Net to send latency, this status interval",
+             [(lbl, m["latency"]["p99Ms"] / 1000) for lbl, (_, m) in zip(labels, devices)]),
+            ("flamecaster_router_packets_received_total", "counter", "DMX packets received by the router",
+             [({}, packetsReceived)]),
+            ("flamecaster_interface_packets_received_total", "counter", "DMX packets received on each interface",
+             [({"interface": receiver.name, "socket": n}, receiver.packetCount)
+              for n, receiver in enumerate(self.receivers)]),
+            ("flamecaster_source_packets_rejected_total", "counter", "Art-Net packets from senders not allowed",
+             [({}, 0 if self.arbiter is None else self.arbiter.rejected)]),
+            ("flamecaster_source_backup_packets_ignored_total", "counter",
+             "Art-Net packets from backup sources ignored while the primary was active",
+             [({}, 0 if self.arbiter is None else self.arbiter.ignored)]),
+            ("flamecaster_source_failovers_total", "counter", "Times a universe switched to a backup source",
+             [({}, 0 if self.arbiter is None else self.arbiter.failovers)]),
+            ("flamecaster_show_frames_played_total", "counter", "Frames played from a recorded show",
+             [({}, 0 if self.showPlayer is None else self.showPlayer.framesPlayed)]),
+            ("flamecaster_show_late_frames_total", "counter", "Show frames played late",
+             [({}, 0 if self.showPlayer is None else self.showPlayer.lateFrames)]),
+            ("flamecaster_router_command_queue_depth", "gauge", "Configuration commands waiting to be applied",
+             [({}, cmdDepth)]),
+            ("flamecaster_devices", "gauge", "Number of configured devices", [({}, len(devices))]),
+        ]
+        return "".join(formatMetric(*family) for family in families)
 
     # use each universe's str() method to convert the printable data in self.universes into a JSON string
     # by calling the __str__ method of each UniverseFragment in the list, and concatenating the results
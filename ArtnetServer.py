@@ -8,7 +8,10 @@ https://github.com/cpvalente/stupidArtnet
 2/2024 ZRanger1
 """
 
+import logging
+import select
 import socket
+import time
 from threading import Thread
 
 
@@ -25,9 +28,24 @@ class ArtnetServer:
     UDP_PORT = 6454
     socket_server = None
     callback = None
-    sequence = 0
     pollReplyPacket = None
 
+    # Art-Net sequence numbers run from 1 to 255, then wrap back to 1.  0 means the sender
+    # isn't using sequence numbers.  A packet up to sequenceWindow steps behind the last one
+    # we accepted on its Port-Address is stale and gets dropped.  Anything further behind than
+    # that means we've lost a lot of packets, and we resynchronize to the new sequence.
+    SEQUENCE_CYCLE = 255
+    sequenceWindow = 32
+
+    # receive buffer setup for zero-copy mode.  Packet data is passed to the callback
+    # as a memoryview into one of RING_SIZE preallocated buffers, so it remains valid
+    # until RING_SIZE more packets have been received.
+    RING_SIZE = 64
+    BUFFER_SIZE = 2048
+
+    # socket timeout, so the receive loop can notice when it's time to shut down
+    RECEIVE_TIMEOUT = 0.5
+
     """
     Art-Net packet header to use for validation
     Here's the full header, including the OpCode and protocol version)
@@ -40,14 +58,56 @@ class ArtnetServer:
     """
     ARTDMX_HEADER = b'Art-Net\x00\x00'
 
-    def __init__(self, listen_ip: str, udp_port: int, pollReplyPacket, callback):
-        """Initializes Art-Net server."""
+    def __init__(self, listen_ip: str, udp_port: int, pollReplyPacket, callback, zeroCopy: bool = True,
+                 batchCallback=None, sequenceWindow: int = 32, syncCallback=None, clock=None,
+                 reusePort: bool = False, arbiter=None, recorder=None, interface: str = ""):
+        """
+        Initializes Art-Net server.
+        If batchCallback is given, the server drains all pending packets from the socket on each
+        pass and hands them to batchCallback as a list of (addr, data) tuples.  Otherwise, callback
+        is called with (addr, data) for each packet.  In zero-copy and batch modes, the data (and
+        the batch list) are only valid for the duration of the call.
+        If syncCallback is given, it is called (with no arguments) when an ArtSync packet arrives.
+        If clock is given, its receiveTime attribute is set instead of our own, so several
+        receivers can share one clock.
+        If reusePort is set, several servers can listen on the same address and port, and the
+        operating system spreads incoming traffic over them (where SO_REUSEPORT is supported).
+        If arbiter is given, it's a SourceArbiter that filters and merges data from multiple senders.
+        If recorder is given, it's a CaptureRecorder, and every packet we dispatch is recorded.
+        If interface is given, we receive everything that arrives on that network interface,
+        broadcasts included, and listen_ip is only used in our ArtPollReply (Linux only).
+        """
         # server active flag
         self.listen = True
         self.callback = callback
         self.listen_ip = listen_ip
         self.UDP_PORT = udp_port
         self.pollReplyPacket = pollReplyPacket
+        self.zeroCopy = zeroCopy
+        self.batchCallback = batchCallback
+        self.syncCallback = syncCallback
+        self.reusePort = reusePort
+        self.interface = interface
+        self.arbiter = arbiter
+        self.recorder = recorder
+        self.lastSource = dict()
+        self.packetCount = 0
+
+        # perf_counter() time the most recent packet (or batch of packets) was received.
+        # Display devices use it to measure latency from the wire to the Pixelblaze.
+        self.receiveTime = 0.0
+        self.clock = self if clock is None else clock
+
+        # batchSizes[n] is the number of batches of n packets received since the last reset
+        self.batchSizes = [0] * (self.RING_SIZE + 1)
+
+        # per Port-Address sequence tracking. Lost and stale packet counters are
+        # dictionaries keyed by Port-Address, and only touched when something goes wrong.
+        self.sequenceWindow = max(0, min(sequenceWindow, self.SEQUENCE_CYCLE // 2))
+        self.lastSequence = bytearray(32768)
+        self.sourceSequence = dict()  # {(Port-Address, IP): last sequence} for sources not seen most recently
+        self.packetsLost = dict()
+        self.packetsStale = dict()
 
         self.server_thread = Thread(target=self.__init_socket, daemon=True)
         self.server_thread.start()
@@ -58,36 +118,291 @@ class ArtnetServer:
         self.socket_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket_server.setsockopt(
             socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reusePort and hasattr(socket, 'SO_REUSEPORT'):
+            self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket_server.settimeout(self.RECEIVE_TIMEOUT)
 
-        # TODO - Eventually may need to bind more than one specific interface, which
-        # might mean multiple sockets.  For now, if you need more than one interface,
-        # just bind to 0.0.0.0
-        self.socket_server.bind((self.listen_ip, self.UDP_PORT))  # Listen on any valid IP
+        # each server binds a single address.  To listen on more than one interface, the
+        # router runs one server per address.  A socket bound to a unicast address doesn't
+        # receive broadcasts, though, so to listen on an interface, we bind the wildcard
+        # address to the interface's device instead.
+        bindIp = self.listen_ip
+        if self.interface:
+            try:
+                self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.interface.encode())
+                bindIp = "0.0.0.0"
+            except (AttributeError, OSError) as e:
+                logging.error("Unable to bind Art-Net receiver to interface %s, listening on %s instead: %s" %
+                              (self.interface, self.listen_ip, str(e)))
+        self.socket_server.bind((bindIp, self.UDP_PORT))
 
-        while self.listen:
+        if self.batchCallback is not None:
+            self.__receive_batch()
+        elif self.zeroCopy:
+            self.__receive_zero_copy()
+        else:
+            self.__receive_simple()
 
-            data, sender = self.socket_server.recvfrom(2048)
+        self.socket_server.close()
+
+    def __receive_simple(self):
+        """
+        Receive loop that allocates a new buffer for every packet.  Simple and
+        safe, since the callback can hold on to the data as long as it likes.
+        """
+        while self.listen:
+            try:
+                data, sender = self.socket_server.recvfrom(self.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            self.clock.receiveTime = time.perf_counter()
 
             # check the header -- we only support Art-Net DMX
             if data[:9] == ArtnetServer.ARTDMX_HEADER:
                 if data[9] == 0x50:
-                    # TODO - check packet sequence number
-                    # At worst, we should track this per-universe and drop out-of-order
-                    # packets, or if the sequence number is too old, indicating an episode of very high
-                    # packet loss, restart the sequence.
-                    # Right now, we're just going to ignore the sequence number
-
-                    new_seq = data[12]
-                    old_seq = self.sequence
-                    self.sequence = new_seq
+                    # drop stale packets before doing any further work
+                    addr = int.from_bytes(data[14:16], byteorder='little')
+                    if self.arbiter is not None:
+                        dmx = self.arbitrate(addr, sender[0], data[12], bytearray(data)[18:])
+                        if dmx is None:
+                            continue
+                    elif data[12] and not self.checkSequence(addr, data[12]):
+                        continue
+                    else:
+                        dmx = bytearray(data)[18:]
 
                     # pass the buffer to the callback function
                     # for distribution to interested pixelblazes
-                    addr = int.from_bytes(data[14:16], byteorder='little')
-                    self.callback(addr, bytearray(data)[18:])
+                    self.packetCount += 1
+                    if self.recorder is not None:
+                        self.recorder.record(addr, dmx)
+                    self.callback(addr, dmx)
+
+                elif data[9] == 0x52:
+                    if self.recorder is not None:
+                        self.recorder.recordSync()
+                    if self.syncCallback is not None:
+                        self.syncCallback()
+
+                elif data[9] == 0x20:
+                    self.send_artnet_poll_reply(sender)
+
+    def __receive_zero_copy(self):
+        """
+        Receive loop that reads packets into a ring of preallocated buffers and
+        passes the callback a memoryview of the DMX data, so packet data is never copied.
+        """
+        ring = [bytearray(self.BUFFER_SIZE) for _ in range(self.RING_SIZE)]
+        views = [memoryview(buf) for buf in ring]
+        recv_into = self.socket_server.recvfrom_into
+        header = ArtnetServer.ARTDMX_HEADER
+        arbiter = self.arbiter
+        slot = 0
+
+        while self.listen:
+            buf = ring[slot]
+            try:
+                nbytes, sender = recv_into(buf)
+            except socket.timeout:
+                continue
+            self.clock.receiveTime = time.perf_counter()
+
+            # check the header -- we only support Art-Net DMX
+            if nbytes > 9 and buf.startswith(header):
+                if buf[9] == 0x50 and nbytes > 18:
+                    # drop stale packets before doing any further work
+                    addr = buf[14] | (buf[15] << 8)
+                    if arbiter is not None:
+                        dmx = self.arbitrate(addr, sender[0], buf[12], views[slot][18:nbytes])
+                        if dmx is None:
+                            continue
+                    elif buf[12] and not self.checkSequence(addr, buf[12]):
+                        continue
+                    else:
+                        dmx = views[slot][18:nbytes]
+
+                    # pass a view of the buffer to the callback function, and move on to
+                    # the next buffer in the ring
+                    self.packetCount += 1
+                    if self.recorder is not None:
+                        self.recorder.record(addr, dmx)
+                    self.callback(addr, dmx)
+                    slot = (slot + 1) % self.RING_SIZE
+
+                elif buf[9] == 0x52:
+                    if self.recorder is not None:
+                        self.recorder.recordSync()
+                    if self.syncCallback is not None:
+                        self.syncCallback()
+
+                elif buf[9] == 0x20:
+                    self.send_artnet_poll_reply(sender)
+
+    def __receive_batch(self):
+        """
+        Zero-copy receive loop that waits for a packet, then drains any other pending
+        packets from the socket without blocking, and dispatches them all at once.
+        Show controllers tend to send all their universes in a burst at the start of each
+        frame, so this amortizes the per-packet overhead across the whole burst.
+        """
+        ring = [bytearray(self.BUFFER_SIZE) for _ in range(self.RING_SIZE)]
+        views = [memoryview(buf) for buf in ring]
+        sock = self.socket_server
+        recv_into = sock.recvfrom_into
+        header = ArtnetServer.ARTDMX_HEADER
+        arbiter = self.arbiter
+        batch = []
+        slot = 0
+
+        # MSG_DONTWAIT lets us do non-blocking reads on a blocking socket.  Where it's not
+        # available (Windows), we poll the socket with select before each extra read.
+        # Either way, the socket must not have a timeout set, since Python waits for the
+        # socket to become readable before every read on a socket with a timeout, so we wait
+        # for the first packet of each batch with select instead.
+        dontwait = getattr(socket, 'MSG_DONTWAIT', 0)
+        sock.settimeout(None)
+
+        while self.listen:
+            if not select.select([sock], [], [], self.RECEIVE_TIMEOUT)[0]:
+                continue
+            nbytes, sender = recv_into(ring[slot])
+            self.clock.receiveTime = time.perf_counter()
+
+            # A batch can hold at most RING_SIZE packets, so no buffer is reused
+            # before the batch callback is done with it.
+            while True:
+                buf = ring[slot]
+                if nbytes > 9 and buf.startswith(header):
+                    if buf[9] == 0x50 and nbytes > 18:
+                        addr = buf[14] | (buf[15] << 8)
+                        if arbiter is not None:
+                            dmx = self.arbitrate(addr, sender[0], buf[12], views[slot][18:nbytes])
+                            if dmx is not None:
+                                batch.append((addr, dmx))
+                                slot = (slot + 1) % self.RING_SIZE
+                        elif buf[12] == 0 or self.checkSequence(addr, buf[12]):
+                            batch.append((addr, views[slot][18:nbytes]))
+                            slot = (slot + 1) % self.RING_SIZE
+
+                    elif buf[9] == 0x52:
+                        # ArtSync applies to all the data received before it, so
+                        # dispatch what we have so far before passing it on.
+                        if batch:
+                            self.__dispatch_batch(batch)
+                        if self.recorder is not None:
+                            self.recorder.recordSync()
+                        if self.syncCallback is not None:
+                            self.syncCallback()
+
+                    elif buf[9] == 0x20:
+                        self.send_artnet_poll_reply(sender)
+
+                if len(batch) >= self.RING_SIZE:
+                    break
+                try:
+                    if dontwait:
+                        nbytes, sender = recv_into(ring[slot], 0, dontwait)
+                    elif select.select([sock], [], [], 0)[0]:
+                        nbytes, sender = recv_into(ring[slot])
+                    else:
+                        break
+                except (BlockingIOError, InterruptedError, socket.timeout):
+                    break
+
+            if batch:
+                self.__dispatch_batch(batch)
+
+    def __dispatch_batch(self, batch: list):
+        """Pass a batch of packets to the batch callback, and update the batch statistics"""
+        self.packetCount += len(batch)
+        self.batchSizes[len(batch)] += 1
+        if self.recorder is not None:
+            self.recorder.recordBatch(batch)
+        self.batchCallback(batch)
+        batch.clear()
+
+    def arbitrate(self, addr: int, ip: str, seq: int, data):
+        """
+        Run a packet past the source arbiter: drop it if its sender isn't allowed, or is a
+        backup that isn't needed, check its sequence number, then merge it with data from
+        any other sources.
+        :param addr: 15-bit Port-Address
+        :param ip: sender's IP address
+        :param seq: packet sequence number, 0-255
+        :param data: DMX data
+        :return: the data to dispatch, or None to drop the packet
+        """
+        arbiter = self.arbiter
+        if not arbiter.admit(addr, ip):
+            return None
+
+        # each source has its own sequence.  When packets from merged sources interleave, put
+        # the last source's sequence aside, and pick up where the new source left off.
+        last = self.lastSource.get(addr)
+        if last != ip:
+            if last is not None:
+                self.sourceSequence[(addr, last)] = self.lastSequence[addr]
+            self.lastSource[addr] = ip
+            self.lastSequence[addr] = self.sourceSequence.get((addr, ip), 0)
+        if seq and not self.checkSequence(addr, seq):
+            return None
+        return arbiter.merge(addr, ip, data)
+
+    def checkSequence(self, addr: int, seq: int) -> bool:
+        """
+        Check an ArtDmx packet's (non-zero) sequence number against the last one accepted
+        on its Port-Address, and count lost and stale packets.
+        :param addr: 15-bit Port-Address
+        :param seq: packet sequence number, 1-255
+        :return: True if the packet should be processed, False if it's stale and should be dropped
+        """
+        last = self.lastSequence[addr]
+        if last != 0:
+            # distance from the last accepted packet, in the 1-255 sequence space
+            delta = (seq - last) % self.SEQUENCE_CYCLE
+
+            # older packets within the window are stale.  Repeats (delta == 0) are let through,
+            # since some senders don't increment the sequence number when retransmitting.
+            if delta >= self.SEQUENCE_CYCLE - self.sequenceWindow:
+                self.packetsStale[addr] = self.packetsStale.get(addr, 0) + 1
+                return False
+
+            # a (reasonable) gap in the sequence means lost packets.  If we're way off, it's
+            # not clear what happened, so we just resynchronize.
+            if 1 < delta <= self.SEQUENCE_CYCLE // 2:
+                self.packetsLost[addr] = self.packetsLost.get(addr, 0) + delta - 1
+
+        self.lastSequence[addr] = seq
+        return True
+
+    def getSequenceStats(self, addresses) -> tuple:
+        """
+        Return the total number of (lost, stale) packets on a set of Port-Addresses since the last reset
+        :param addresses: iterable of Port-Addresses
+        :return: (lost, stale) tuple
+        """
+        lost = self.packetsLost
+        stale = self.packetsStale
+        return sum(lost.get(a, 0) for a in addresses), sum(stale.get(a, 0) for a in addresses)
+
+    def resetSequenceStats(self):
+        """Reset the lost and stale packet counters for all Port-Addresses"""
+        self.packetsLost = dict()
+        self.packetsStale = dict()
+
+    def resetBatchSizes(self):
+        """
+        Return the batch size distribution since the last reset as a dictionary of
+        {batch size: number of batches}, and start counting again.
+        """
+        sizes = self.batchSizes
+        self.batchSizes = [0] * (self.RING_SIZE + 1)
+        return {n: count for n, count in enumerate(sizes) if count > 0}
 
-            elif data[9] == 0x20:
-                self.send_artnet_poll_reply(sender)
+    @property
+    def name(self) -> str:
+        """Name of the interface we're listening on, for status reports"""
+        return "artnet/%s:%d" % (self.interface or self.listen_ip, self.UDP_PORT)
 
     def send_artnet_poll_reply(self, address):
         """
@@ -10,15 +10,49 @@ from DisplayDevice import DisplayDevice
 from Universe import *
 
 
+class ConfigDiff:
+    """
+    The differences between two configurations, as computed by ConfigParser.diff().
+    Devices whose own settings have changed have to be rebuilt, but devices whose only
+    changes are to their universe fragments are kept, and just have their fragments updated.
+    """
+    def __init__(self):
+        self.systemChanged = False
+        self.devicesAdded = dict()  # new device configs, keyed by device key
+        self.devicesRemoved = []  # keys of devices that are gone
+        self.devicesChanged = dict()  # configs of devices that need rebuilding, keyed by device key
+        self.fragmentsAdded = dict()  # new fragment configs, keyed by (device key, fragment key)
+        self.fragmentsRemoved = []  # (device key, fragment key) of fragments that are gone
+        self.fragmentsMoved = dict()  # changed fragment configs, keyed by (device key, fragment key)
+
+    def isEmpty(self) -> bool:
+        return not (self.systemChanged or self.devicesAdded or self.devicesRemoved or self.devicesChanged or
+                    self.fragmentsAdded or self.fragmentsRemoved or self.fragmentsMoved)
+
+    def rebuiltDevices(self) -> list:
+        """Return the keys of all devices that will be (re)built when this diff is applied"""
+        return list(self.devicesAdded) + list(self.devicesChanged)
+
+    def __str__(self):
+        return ("devices: %d added, %d removed, %d changed; fragments: %d added, %d removed, %d moved" %
+                (len(self.devicesAdded), len(self.devicesRemoved), len(self.devicesChanged),
+                 len(self.fragmentsAdded), len(self.fragmentsRemoved), len(self.fragmentsMoved)))
+
+
 class ConfigParser:
-    deviceList = dict()
-    universes = dict()
-    systemSettings = dict()
+    def __init__(self):
+        self.deviceList = dict()
+        self.universes = dict()
+        self.dispatchTable = dict()
+        self.systemSettings = dict()
+        self.fragments = dict()  # each device's UniverseFragments, keyed by device key, then fragment key
+        self.config = None
 
-    def parseDeviceInfo(self, config):
+    def parseDeviceInfo(self, config, startOutput: bool = True):
         """
         Extract device and universe data from the configuration dictionary and
-        create DisplayDevice objects for each device.
+        create DisplayDevice objects for each device.  If startOutput is False, the
+        devices won't connect to their Pixelblazes.
         """
 
         # process our list of Pixelblazes
@@ -29,16 +63,38 @@ class ConfigParser:
 
             # parse device record and add to hardware device list
         for key in devices:
-            dev = DisplayDevice(getParam(devices, key), self.systemSettings)
-            self.deviceList[key] = dev
+            self.addDevice(key, getParam(devices, key), startOutput)
 
-            self.getDeviceUniverses(dev, devices[key])
+    def addDevice(self, key, config, startOutput: bool = True) -> DisplayDevice:
+        """
+        Create a DisplayDevice and its universe fragments from a device configuration
+        :param key: device key
+        :param config: device configuration dictionary
+        :param startOutput: if False, the device won't connect to its Pixelblaze
+        :return: the new DisplayDevice
+        """
+        dev = DisplayDevice(config, self.systemSettings, startOutput)
+        self.deviceList[key] = dev
+        self.fragments[key] = dict()
+        self.getDeviceUniverses(key, config)
+        return dev
 
-    def getDeviceUniverses(self, device, config):
+    def removeDevice(self, key) -> DisplayDevice:
+        """
+        Remove a device and its universe fragments.  The device is not stopped.
+        :param key: device key
+        :return: the removed DisplayDevice
+        """
+        for fragKey in list(self.fragments[key]):
+            self.removeFragment(key, fragKey)
+        del self.fragments[key]
+        return self.deviceList.pop(key)
+
+    def getDeviceUniverses(self, key, config):
         """
         Extract universe data for a given device from the configuration dictionary
         and add it to the device's universe list
-        :param device: DisplayDevice object for this device
+        :param key: key of the DisplayDevice object for this device
         :param config: dictionary containing universe info for the given device
         """
         # get key to universe fragments for this device
@@ -46,13 +102,152 @@ class ConfigParser:
         #if data is None:
             #return None
 
-        for key in data:
-            fragment = UniverseFragment(device, getParam(data, key))
+        for fragKey in data:
+            self.addFragment(key, fragKey, getParam(data, fragKey))
 
-            if keyExists(self.universes, fragment.address_mask):
-                self.universes[fragment.address_mask].append(fragment)
-            else:
-                self.universes[fragment.address_mask] = [fragment]
+    def addFragment(self, key, fragKey, record):
+        """
+        Create a UniverseFragment for a device, and add it to the universe map
+        :param key: device key
+        :param fragKey: fragment key
+        :param record: fragment configuration dictionary
+        """
+        device = self.deviceList[key]
+        fragment = UniverseFragment(device, record)
+        device.addresses.add(fragment.address_mask)
+        fragment.fragmentBit = device.addFragment()
+        self.fragments[key][fragKey] = fragment
+
+        if keyExists(self.universes, fragment.address_mask):
+            self.universes[fragment.address_mask].append(fragment)
+        else:
+            self.universes[fragment.address_mask] = [fragment]
+
+    def removeFragment(self, key, fragKey):
+        """
+        Remove a UniverseFragment from its device and the universe map
+        :param key: device key
+        :param fragKey: fragment key
+        """
+        fragment = self.fragments[key].pop(fragKey)
+        fragments = self.universes[fragment.address_mask]
+        fragments.remove(fragment)
+        if len(fragments) == 0:
+            del self.universes[fragment.address_mask]
+
+        device = fragment.device
+        device.removeFragment(fragment.fragmentBit)
+        device.addresses = set(f.address_mask for f in self.fragments[key].values())
+
+    @staticmethod
+    def diff(old: dict, new: dict) -> ConfigDiff:
+        """
+        Compare two configurations
+        :param old: the current configuration
+        :param new: the new configuration
+        :return: ConfigDiff describing the changes needed to get from old to new
+        """
+        result = ConfigDiff()
+        result.systemChanged = getParam(old, "system") != getParam(new, "system")
+
+        oldDevices = getParam(old, "devices", dict())
+        newDevices = getParam(new, "devices", dict())
+        result.devicesRemoved = [key for key in oldDevices if key not in newDevices]
+
+        for key in newDevices:
+            if key not in oldDevices:
+                result.devicesAdded[key] = newDevices[key]
+                continue
+            o = oldDevices[key]
+            n = newDevices[key]
+            if o == n:
+                continue
+
+            # any change to the device's own settings means rebuilding the device
+            if {k: o[k] for k in o if k != "data"} != {k: n[k] for k in n if k != "data"}:
+                result.devicesChanged[key] = n
+                continue
+
+            oldData = getParam(o, "data", dict())
+            newData = getParam(n, "data", dict())
+            for fragKey in oldData:
+                if fragKey not in newData:
+                    result.fragmentsRemoved.append((key, fragKey))
+            for fragKey in newData:
+                if fragKey not in oldData:
+                    result.fragmentsAdded[(key, fragKey)] = newData[fragKey]
+                elif oldData[fragKey] != newData[fragKey]:
+                    result.fragmentsMoved[(key, fragKey)] = newData[fragKey]
+
+        return result
+
+    def applyDiff(self, data: dict, diff: ConfigDiff, startOutput: bool = True):
+        """
+        Bring the parsed configuration up to date with a new configuration, creating only the
+        objects that have changed.  The device list and universe map are replaced rather than
+        modified, so anybody still using the old ones sees a consistent picture.  System
+        setting changes are not applied.
+        :param data: the new configuration
+        :param diff: the changes, from diff(current configuration, data)
+        :param startOutput: if False, new devices won't connect to their Pixelblazes
+        :return: tuple of (removed devices, new devices), as dictionaries keyed by device key.
+        Removed devices have not been stopped.
+        """
+        self.deviceList = dict(self.deviceList)
+        self.universes = {addr: list(self.universes[addr]) for addr in self.universes}
+
+        removed = dict()
+        for key in diff.devicesRemoved + list(diff.devicesChanged):
+            removed[key] = self.removeDevice(key)
+
+        for key, fragKey in diff.fragmentsRemoved:
+            self.removeFragment(key, fragKey)
+        for (key, fragKey), record in diff.fragmentsMoved.items():
+            self.removeFragment(key, fragKey)
+            self.addFragment(key, fragKey, record)
+        for (key, fragKey), record in diff.fragmentsAdded.items():
+            self.addFragment(key, fragKey, record)
+
+        added = dict()
+        for key in diff.rebuiltDevices():
+            added[key] = self.addDevice(key, getParam(data["devices"], key), startOutput)
+
+        self.config = data
+        self.dispatchTable = self.buildDispatchTable(self.universes)
+        return removed, added
+
+    @staticmethod
+    def buildDispatchTable(universes: dict):
+        """
+        Build the lookup table used to dispatch incoming packets.  The table is keyed by
+        15-bit Art-Net Port-Address, and each entry is a tuple of
+        (packet handler, startChannel, destIndex, pixelCount, fragmentBit) records, one per
+        UniverseFragment listening on that address.
+        :param universes: dictionary of UniverseFragment lists, keyed by address mask
+        :return: dispatch table dictionary
+        """
+        table = dict()
+        for addr in universes:
+            table[addr] = tuple((k.device.process_packet, k.startChannel, k.destIndex, k.pixelCount,
+                                 k.fragmentBit) for k in universes[addr])
+        return table
+
+    @staticmethod
+    def getArtnetListeners(system: dict) -> list:
+        """
+        Return the addresses to listen for Art-Net on.  The "listenArtnet" setting is a list of
+        {"ip": ..., "port": ..., "interface": ...} records, where port defaults to "portArtnet".
+        "interface" is a network interface name, and is optional.  If it's empty, we listen on
+        "ipArtnet":"portArtnet".
+        :param system: system configuration
+        :return: list of (ip, port, interface) tuples.  interface is "" if none was given.
+        """
+        port = getParam(system, "portArtnet", 6454)
+        listeners = [(getParam(entry, "ip", "0.0.0.0"), int(getParam(entry, "port", port)),
+                      getParam(entry, "interface", "")) for entry in getParam(system, "listenArtnet", [])]
+        if not listeners:
+            listeners = [(getParam(system, "ipArtnet", "0.0.0.0"), port, "")]
+        return listeners
 
     @staticmethod
     def setSystemDefaults(data: dict):
@@ -63,10 +258,30 @@ class ConfigParser:
             data["system"] = dict()
 
         data["system"]["maxFps"] = getParam(data["system"], "maxFps", 30)
+        data["system"]["keepaliveMs"] = getParam(data["system"], "keepaliveMs", 1000)
+        data["system"]["keyframeIntervalMs"] = getParam(data["system"], "keyframeIntervalMs", 1000)
         data["system"]["statusUpdateIntervalMs"] = getParam(data["system"], "statusUpdateIntervalMs", 3000)
         data["system"]["pixelsPerUniverse"] = getParam(data["system"], "pixelsPerUniverse", 170)
         data["system"]["ipArtnet"] = getParam(data["system"], "ipArtnet", "0.0.0.0")
         data["system"]["portArtnet"] = getParam(data["system"], "portArtnet", 6454)
+        data["system"]["listenArtnet"] = getParam(data["system"], "listenArtnet", [])
+        data["system"]["outputEngine"] = getParam(data["system"], "outputEngine", "threads")
+        data["system"]["latePolicy"] = getParam(data["system"], "latePolicy", "skip")
+        data["system"]["phaseAlign"] = getParam(data["system"], "phaseAlign", False)
+        data["system"]["outputShards"] = getParam(data["system"], "outputShards", 0)
+        data["system"]["latencyLogFile"] = getParam(data["system"], "latencyLogFile", "")
+        data["system"]["frameStores"] = getParam(data["system"], "frameStores", False)
+        data["system"]["metricsPort"] = getParam(data["system"], "metricsPort", 0)
+        data["system"]["ipMetrics"] = getParam(data["system"], "ipMetrics", "")
+        data["system"]["receiveMode"] = getParam(data["system"], "receiveMode", "batch")
+        data["system"]["sequenceWindow"] = getParam(data["system"], "sequenceWindow", 32)
+        data["system"]["sourcePolicy"] = getParam(data["system"], "sourcePolicy", "any")
+        data["system"]["allowedSources"] = getParam(data["system"], "allowedSources", [])
+        data["system"]["primarySource"] = getParam(data["system"], "primarySource", "")
+        data["system"]["sourceTimeoutMs"] = getParam(data["system"], "sourceTimeoutMs", 2500)
+        data["system"]["sacnEnabled"] = getParam(data["system"], "sacnEnabled", False)
+        data["system"]["ipSacn"] = getParam(data["system"], "ipSacn", "0.0.0.0")
+        data["system"]["sacnUniverseOffset"] = getParam(data["system"], "sacnUniverseOffset", 1)
         data["system"]["ipWebInterface"] = getParam(data["system"], "ipWebInterface", "127.0.0.1")
         data["system"]["portWebInterface"] = getParam(data["system"], "portWebInterface", 8081)
         data["devices"] = getParam(data, "devices", dict())
@@ -108,7 +323,7 @@ class ConfigParser:
         except Exception as e:
             logging.error("Error writing config file %s: %s" % (fileName, str(e)))
 
-    def parse(self, data: dict):
+    def parse(self, data: dict, startOutput: bool = True):
         """
         Parse and validate configuration data from a loaded JSON blob
         """
@@ -117,7 +332,9 @@ class ConfigParser:
             logging.error("Error: No configuration data found in config file. Exiting.")
             sys.exit()
 
+        self.config = data
         self.systemSettings = getParam(data, "system")
-        self.parseDeviceInfo(data)
+        self.parseDeviceInfo(data, startOutput)
+        self.dispatchTable = self.buildDispatchTable(self.universes)
 
-        return self.systemSettings, self.deviceList, self.universes
+        return self.systemSettings, self.deviceList, self.universes, self.dispatchTable
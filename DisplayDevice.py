@@ -9,10 +9,22 @@ import logging
 import threading
 from threading import Thread
 
-# import numpy as np
 import select
 
+# numpy is optional.  If it's available, we use it to pack pixel data in bulk.
+# Otherwise, we fall back to the (much slower) per-pixel loop.  Shared frame
+# buffers also require numpy.
+try:
+    import numpy as np
+    from SharedFrames import FrameStore, SharedFrameBuffer
+except ImportError:
+    np = None
+    FrameStore = None
+    SharedFrameBuffer = None
+
 from ArtnetUtils import *
+from FramePacer import FramePacer
+from Metrics import LatencyHistogram
 from pixelblaze import *
 
 
@@ -32,7 +44,36 @@ class DisplayDevice:
     ms_per_frame = 0
     packets_in = 0
     packets_out = 0
-    run_flag = threading.Event()
+    packets_lost = 0
+    packets_stale = 0
+    syncFrames = False
+    frameReady = False
+    fragmentMask = 0
+    fragmentsRefreshed = 0
+    deltaFrames = False
+    nextKeyframe = 0
+    nextKeepalive = 0
+    frames_skipped = 0
+    bytes_out = 0
+    encodes = 0
+    encodeSeconds = 0.0
+    connects = 0
+    totals = None
+    run_flag = None
+    sharedInput = None
+    sharedOutput = None
+    frameStore = None
+    lastError = ""
+    receiveClock = None
+    frameReceiveTime = 0.0
+    frameDecodeTime = 0.0
+    sendReceiveTime = 0.0
+    sendDecodeTime = 0.0
+    completedFrame = None
+    completedReceiveTime = 0.0
+    completedDecodeTime = 0.0
+    sharedBuffer = None
+    storeFragments = 0
     sendFlag = False
     sendFrame = None
 
@@ -42,7 +83,18 @@ class DisplayDevice:
         Pixels = 0
         Fixture = 1
 
-    def __init__(self, device, config):
+    # changed pixel ranges separated by this many unchanged pixels or fewer are
+    # merged into a single range, since each range costs two extra values to send.
+    DELTA_MERGE_GAP = 2
+
+    # interval counters that are also kept as running totals
+    TOTALED_COUNTERS = ("packets_in", "packets_out", "packets_lost", "packets_stale",
+                        "frames_skipped", "pixelsReceived")
+
+    def __init__(self, device, config, startOutput: bool = True):
+
+        # Art-Net Port-Addresses this device listens to
+        self.addresses = set()
 
         # set up device information record
         self.ip = getParam(device, 'ip', "")
@@ -51,33 +103,95 @@ class DisplayDevice:
         s = getParam(device, 'deviceStyle', "pixels")
         if s == "pixels":
             self.deviceStyle = self.DeviceStyles.Pixels
-            self.packetHandler = self.process_pixel_data
+            self.packetHandler = self.process_pixel_data if np is None else self.process_pixel_data_np
         else:
             self.deviceStyle = self.DeviceStyles.Fixture
             self.packetHandler = self.process_channel_data
             self.channelData = bytearray(self.pixelCount)
 
+        # if syncFrames is set, we only send complete frames -- either when an ArtSync packet
+        # arrives, or when all the device's universe fragments have been refreshed.  Each frame
+        # is copied as it completes, and frameLock guards the hand-off to the output side.
+        self.syncFrames = getParam(device, 'syncFrames', False)
+        self.frameLock = threading.Lock()
+
         # both the device and the system configuration can specify a maxFps.
         # We take the lowest of the two.
         self.maxFps = getParam(device, 'maxFps', 1000)
         self.maxFps = min(config["maxFps"], self.maxFps)
-        self.sec_per_frame = 1 / self.maxFps
-        # account for overhead in the frame timer
-        self.sec_per_frame -= 0.05 * self.sec_per_frame
+
+        # the frame pacer keeps output on schedule.  If we fall behind, the "latePolicy" setting
+        # decides whether we "skip" missed frames or "catchup".  If "phaseAlign" is set, devices
+        # with the same frame rate all send their frames at the same time.
+        policy = getParam(device, 'latePolicy', config.get('latePolicy', "skip"))
+        self.pacer = FramePacer(self.maxFps,
+                                FramePacer.LatePolicy.CatchUp if policy == "catchup" else FramePacer.LatePolicy.Skip,
+                                config.get('phaseAlign', False))
+
+        # latency from Art-Net packet arrival to websocket send, and to the end of decoding
+        self.latency = LatencyHistogram()
+        self.decodeLatency = LatencyHistogram()
+
+        # running totals of the interval counters, which resetCounters() folds in, so
+        # monitoring can see counters that never go backwards.
+        self.totals = dict.fromkeys(self.TOTALED_COUNTERS, 0)
 
         self.sendMethod = self._send_pre_init
 
-        # initialize output pixel buffer
-        self.pixels = [0] * self.pixelCount
+        # initialize output pixel buffer.  With numpy, the buffer is a preallocated
+        # float array, and we keep a matching int32 array as scratch space for packing.
+        if np is None:
+            self.pixels = [0] * self.pixelCount
+        else:
+            self.pixels = np.zeros(self.pixelCount, dtype=np.float64)
+            self.packedPixels = np.zeros(self.pixelCount, dtype=np.int32)
+
+        # frames identical to the last one sent are skipped, except that we resend
+        # at least every keepaliveMs so the Pixelblaze knows we're still here.
+        # Both the device and the system configuration can set this.
+        self.keepaliveInterval = getParam(device, 'keepaliveMs', config.get('keepaliveMs', 1000)) / 1000
+        if self.deviceStyle == self.DeviceStyles.Fixture:
+            self.outputBuffer = self.channelData
+        else:
+            self.outputBuffer = self.pixels
+        self.lastFrame = self.outputBuffer.copy()
+
+        # in delta mode, JSON pixel devices only send the pixel ranges that have changed
+        # since the last keyframe, with a full keyframe at regular intervals.
+        self.deltaFrames = getParam(device, 'deltaFrames', False) and self.deviceStyle == self.DeviceStyles.Pixels
+        self.keyframeInterval = getParam(device, 'keyframeIntervalMs', config.get('keyframeIntervalMs', 1000)) / 1000
+        if self.deltaFrames:
+            self.lastSentPixels = self.pixels.copy()
+            # pixels that have changed since the last keyframe
+            self.deltaDirty = [False] * self.pixelCount if np is None else np.zeros(self.pixelCount, dtype=bool)
+
+        # start the display device thread, unless the device's output is going to be
+        # handled by the shared asyncio output scheduler, or by another process.
+        self.run_flag = threading.Event()
+        self.run_flag.set()
+        if startOutput and config.get('outputEngine', "threads") != "asyncio":
+            self.startOutputThread()
 
-        # start the display device thread
+    @staticmethod
+    def getOutputBufferSize(device: dict) -> int:
+        """
+        Return the size in bytes of the output buffer a device with the given configuration will use
+        (assuming numpy is available).
+        :param device: device configuration dictionary
+        """
+        pixelCount = getParam(device, 'pixelCount', 0)
+        if getParam(device, 'deviceStyle', "pixels") != "pixels":
+            return pixelCount
+        return 8 * pixelCount
+
+    def startOutputThread(self):
+        """Start the thread that maintains the Pixelblaze connection and sends it frames."""
         thread = Thread(target=self.run_thread)
         thread.daemon = True
-        self.run_flag.set()
-        self.frame_timer = 0
         thread.start()
 
-    def process_packet(self, dmxPixels: bytearray, startChannel: int, destPixel: int, count: int):
+    def process_packet(self, dmxPixels: bytearray, startChannel: int, destPixel: int, count: int,
+                       fragmentBit: int = 0):
         """
         Process a packet of DMX data.  This function is called by the main
         ArtnetServer thread when a packet is received.  It will process the
@@ -87,9 +201,239 @@ class DisplayDevice:
         :param startChannel: starting channel in the Artnet packet
         :param destPixel: index of first pixel or channel in destination array
         :param count: number of pixels or channels to process
+        :param fragmentBit: bit identifying the universe fragment this data belongs to
         """
         self.packetHandler(dmxPixels, startChannel, destPixel, count)
 
+        # timestamp the first packet of each frame, for latency measurement
+        if self.frameReceiveTime == 0.0:
+            self.frameDecodeTime = time.perf_counter()
+            self.frameReceiveTime = self.receiveClock.receiveTime if self.receiveClock is not None \
+                else self.frameDecodeTime
+
+        # keep track of which fragments we've seen since the last frame was sent
+        # (masked, since data for a fragment removed by a config change may still be in flight)
+        self.fragmentsRefreshed |= fragmentBit
+        if (self.fragmentsRefreshed & self.fragmentMask) == self.fragmentMask:
+            self.completeFrame()
+
+        # if another process is sending our frames, let it know there's new data
+        if self.sharedInput is not None:
+            self.publishUpdate()
+
+        # publish complete frames to the frame store
+        if self.frameStore is not None:
+            self.storeFragments |= fragmentBit
+            if (self.storeFragments & self.fragmentMask) == self.fragmentMask:
+                self.publishFrame()
+
+    def addFragment(self) -> int:
+        """
+        Register a universe fragment with this device, for frame completion tracking.
+        :return: the bit identifying the new fragment
+        """
+        bit = ~self.fragmentMask & (self.fragmentMask + 1)
+        self.fragmentMask |= bit
+        return bit
+
+    def removeFragment(self, bit: int):
+        """
+        Unregister a universe fragment, so frames no longer wait for its data.
+        :param bit: the bit identifying the fragment, as returned by addFragment()
+        """
+        self.fragmentMask &= ~bit
+        self.fragmentsRefreshed &= self.fragmentMask
+        self.storeFragments &= self.fragmentMask
+
+    def sync(self):
+        """
+        Called when an ArtSync packet arrives. Marks the current frame as complete
+        if any data has arrived since the last one was completed.
+        """
+        if self.fragmentsRefreshed:
+            self.completeFrame()
+            if self.sharedInput is not None:
+                self.publishUpdate()
+        if self.storeFragments:
+            self.publishFrame()
+
+    def completeFrame(self):
+        """
+        Mark the current frame as complete.  If we're syncing frames and sending them ourselves,
+        snapshot the frame for the output side and start tracking the next frame right away,
+        so packets for the next frame can't tear this one, or be lost when it's sent.
+        """
+        if self.syncFrames and self.sharedInput is None:
+            frame = self.outputBuffer.copy()
+            with self.frameLock:
+                self.completedFrame = frame
+                self.completedReceiveTime = self.frameReceiveTime
+                self.completedDecodeTime = self.frameDecodeTime
+            self.fragmentsRefreshed = 0
+            self.frameReceiveTime = 0.0
+        else:
+            self.frameReady = True
+
+    def attachFrameStore(self, store):
+        """
+        Publish this device's complete frames to a shared memory frame store, where other
+        processes can read them.
+        :param store: FrameStore to publish to
+        """
+        self.frameStore = store
+        self.storeFragments = 0
+
+    def publishFrame(self):
+        """Copy the current output buffer to the frame store"""
+        self.frameStore.publish(self.outputBuffer)
+        self.storeFragments = 0
+
+    def attachSharedInput(self, shared):
+        """
+        Move this device's output buffer into a shared frame buffer, which will be sent to the
+        Pixelblaze by another process.  This side of the buffer only receives data.
+        :param shared: SharedFrameBuffer to attach to
+        """
+        self._attachSharedBuffer(shared)
+        self.sharedInput = shared.header
+        self.lastPacketsOut = shared.header[SharedFrameBuffer.PACKETS_OUT]
+        self.lastSkipped = shared.header[SharedFrameBuffer.SKIPPED]
+        self.latencyBaseline = shared.latency.copy()
+
+    def attachSharedOutput(self, shared):
+        """
+        Move this device's output buffer into a shared frame buffer, whose data comes from
+        another process.  This side of the buffer only sends data to the Pixelblaze.
+        :param shared: SharedFrameBuffer to attach to
+        """
+        self._attachSharedBuffer(shared)
+        self.sharedOutput = shared.header
+        self.seenUpdates = self.pendingUpdates = shared.header[SharedFrameBuffer.UPDATES]
+        self.seenFrames = self.pendingFrames = shared.header[SharedFrameBuffer.FRAMES]
+        self.readyToSend = self._readyToSendShared
+
+    def _attachSharedBuffer(self, shared):
+        """Rebuild the output buffer as a view of a shared frame buffer's data"""
+        self.sharedBuffer = shared
+        if self.deviceStyle == self.DeviceStyles.Fixture:
+            self.channelData = shared.data
+            self.outputBuffer = self.channelData
+        else:
+            self.pixels = shared.data.view(np.float64)
+            self.outputBuffer = self.pixels
+        self.lastFrame = self.outputBuffer.copy()
+
+    def publishUpdate(self):
+        """
+        Tell the output process that there is new data in the shared buffer.  Since we don't send
+        frames ourselves, we clear each frame as soon as it's complete.  If we're syncing frames,
+        complete frames are copied to the shared buffer's frame area, which the output process
+        sends from.  Either way, the frame's receive time goes along with it, so the output
+        process can measure latency.  (perf_counter() is system wide, so times can be compared
+        between processes.)
+        """
+        h = self.sharedInput
+        if self.syncFrames:
+            if self.frameReady:
+                self.sharedBuffer.writeFrame(self.frameReceiveTime, self.frameDecodeTime)
+        else:
+            h[SharedFrameBuffer.RECEIVE_TIME] = self.frameReceiveTime
+            h[SharedFrameBuffer.DECODE_TIME] = self.frameDecodeTime
+        h[SharedFrameBuffer.UPDATES] += 1
+        if self.frameReady:
+            h[SharedFrameBuffer.FRAMES] += 1
+            self.clearFrame()
+
+    def _readyToSendShared(self) -> bool:
+        """readyToSend() for a device whose data arrives via a shared frame buffer"""
+        h = self.sharedOutput
+        self.pendingUpdates = h[SharedFrameBuffer.UPDATES]
+        self.pendingFrames = h[SharedFrameBuffer.FRAMES]
+        if self.syncFrames:
+            return self.pendingFrames != self.seenFrames
+        return self.pendingUpdates != self.seenUpdates
+
+    def publishOutputStats(self):
+        """Write connection status and frame timing statistics to the shared frame buffer"""
+        h = self.sharedOutput
+        h[SharedFrameBuffer.CONNECTED] = 1 if self.pb is not None and self.pb.is_connected() else 0
+        stats = self.pacer.getStats()
+        h[SharedFrameBuffer.INTERVAL_MS] = stats["intervalMs"]
+        h[SharedFrameBuffer.JITTER_MS] = stats["jitterMs"]
+        h[SharedFrameBuffer.MAX_ERROR_MS] = stats["maxErrorMs"]
+        h[SharedFrameBuffer.MISSED] = stats["missed"]
+        self.pacer.resetStats()
+
+    def readyToSend(self) -> bool:
+        """
+        Returns True if there's a frame to send.  If we're syncing frames, that means a
+        complete frame, otherwise it's any new data at all.
+        """
+        if self.syncFrames:
+            return self.completedFrame is not None
+        return self.pixelsUpdated > 0
+
+    def takeFrame(self):
+        """
+        If there's a frame to send, take a snapshot of it and reset the frame tracking state.
+        Everything about the frame we send comes from the snapshot, and data that arrives while
+        it's being sent counts towards the next frame.
+        :return: a copy of the output buffer, or None if there's nothing to send
+        """
+        if not self.readyToSend():
+            return None
+        if self.syncFrames and self.sharedOutput is None:
+            # the frame was copied when it completed
+            with self.frameLock:
+                frame = self.completedFrame
+                self.completedFrame = None
+                self.sendReceiveTime = self.completedReceiveTime
+                self.sendDecodeTime = self.completedDecodeTime
+            return frame
+
+        if self.sharedOutput is not None:
+            self.clearFrame()
+            if self.syncFrames:
+                frame, self.sendReceiveTime, self.sendDecodeTime = self.sharedBuffer.readFrame()
+                return frame.view(self.outputBuffer.dtype)
+            self.sendReceiveTime = self.sharedOutput[SharedFrameBuffer.RECEIVE_TIME]
+            self.sendDecodeTime = self.sharedOutput[SharedFrameBuffer.DECODE_TIME]
+            return self.outputBuffer.copy()
+
+        self.sendReceiveTime = self.frameReceiveTime
+        self.sendDecodeTime = self.frameDecodeTime
+        self.clearFrame()
+        return self.outputBuffer.copy()
+
+    def frameSent(self):
+        """
+        Update the counters after a frame has been sent.
+        """
+        self.packets_out += 1
+        self.pacer.frameDone()
+        if self.sharedOutput is not None:
+            self.sharedOutput[SharedFrameBuffer.PACKETS_OUT] += 1
+
+        # latency is measured from the arrival of the oldest data in the frame
+        if self.sendReceiveTime > 0.0:
+            t = time.perf_counter()
+            self.latency.record(t - self.sendReceiveTime)
+            self.decodeLatency.record(self.sendDecodeTime - self.sendReceiveTime)
+            if self.sharedOutput is not None:
+                self.sharedBuffer.recordLatency(t - self.sendReceiveTime, self.sendDecodeTime - self.sendReceiveTime)
+
+    def clearFrame(self):
+        """
+        Reset the frame tracking state, without counting a frame as sent.
+        """
+        self.pixelsUpdated = 0
+        self.frameReady = False
+        self.fragmentsRefreshed = 0
+        self.frameReceiveTime = 0.0
+        if self.sharedOutput is not None:
+            self.seenUpdates = self.pendingUpdates
+            self.seenFrames = self.pendingFrames
+
     def process_channel_data(self, dmxPixels: bytearray, startChannel: int, destChannel: int, count: int):
         self.packets_in += 1
         self.pixelsReceived += count
@@ -132,13 +476,76 @@ class DisplayDevice:
                 index + 2]) / 256.0
 
             # The Pixelblaze uses a 16.16 fixed point, two's complement representation for pixel data.
-            # If the value is greater than 32767, we need to subtract 65536 to convert it to a negative number
+            # If the value is 32768 or more, we need to subtract 65536 to convert it to a negative number
             # to keep it in a range the Pixelblaze can understand.
-            if self.pixels[pixNum] > 32767:
+            if self.pixels[pixNum] >= 32768:
                 self.pixels[pixNum] = self.pixels[pixNum] - 65536
             pixNum += 1
             index += 3
 
+    def process_pixel_data_np(self, dmxPixels: bytearray, startChannel: int, destPixel: int, count: int):
+        """
+        Vectorized version of process_pixel_data.  Packs a whole universe fragment
+        into the device's pixel buffer in one go.  Produces the same values as
+        the per-pixel loop (benchmarks/router_benchmark.py checks this).
+        :param dmxPixels: byte array of RGB pixels received from Artnet source
+        :param startChannel: starting channel in the Artnet packet
+        :param destPixel: index of first pixel in destination array
+        :param count: number of pixels to process
+        """
+        self.packets_in += 1
+        self.pixelsReceived += count
+        self.pixelsUpdated += count
+
+        # clamp the pixel count to both the device's buffer and the data actually in the packet
+        index = 3 * startChannel
+        count = min(count, self.pixelCount - destPixel, (len(dmxPixels) - index) // 3)
+        if count <= 0:
+            return
+
+        rgb = np.frombuffer(dmxPixels, dtype=np.uint8, count=3 * count, offset=index)
+        packed = self.packedPixels[destPixel:destPixel + count]
+
+        # shift red, green and blue into a 24-bit integer
+        packed[:] = rgb[0::3]
+        packed <<= 8
+        packed |= rgb[1::3]
+        packed <<= 8
+        packed |= rgb[2::3]
+
+        # sign-extend from 24 bits, so that after dividing by 256 we have a value
+        # in the Pixelblaze's signed 16.16 fixed point range.
+        packed ^= 0x800000
+        packed -= 0x800000
+        np.multiply(packed, 1.0 / 256.0, out=self.pixels[destPixel:destPixel + count])
+
+    def isRepeatFrame(self, frame) -> bool:
+        """
+        Returns True if a frame is identical to the last frame sent and no keepalive is due,
+        in which case we can skip sending it.
+        :param frame: the frame, as returned by takeFrame()
+        """
+        if np is not None and isinstance(frame, np.ndarray):
+            same = np.array_equal(frame, self.lastFrame)
+        else:
+            same = frame == self.lastFrame
+
+        if same and time.time() < self.nextKeepalive:
+            self.frames_skipped += 1
+            if self.sharedOutput is not None:
+                self.sharedOutput[SharedFrameBuffer.SKIPPED] += 1
+            return True
+        return False
+
+    def frameTransmitted(self, frame):
+        """
+        Remember the frame we just sent, so we can recognize repeats, then update the counters.
+        :param frame: the frame, as returned by takeFrame()
+        """
+        self.lastFrame = frame
+        self.nextKeepalive = time.time() + self.keepaliveInterval
+        self.frameSent()
+
     def _send_pre_init(self):
         """
         Idle send function - runs until a Pixelblaze is connected.  Keeps track
@@ -148,8 +555,18 @@ class DisplayDevice:
         """
 
         if self.pb is not None and self.pb.is_connected():
+            self.connects += 1
+            if self.sharedOutput is not None:
+                self.sharedOutput[SharedFrameBuffer.CONNECTS] += 1
+            # always send the first frame after connecting, even if it's a repeat
+            self.nextKeepalive = 0
+
             if self.deviceStyle == self.DeviceStyles.Fixture:
                 self.sendMethod = self._send_channel_data
+            elif self.deltaFrames:
+                # start with a keyframe, since we don't know what the Pixelblaze has
+                self.nextKeyframe = 0
+                self.sendMethod = self._send_delta_data
             else:
                 self.sendMethod = self._send_pixel_data
 
@@ -158,28 +575,127 @@ class DisplayDevice:
         Send a frame of packed pixel data to the Pixelblaze
         """
 
-        if self.pixelsUpdated > 0:
+        frame = self.takeFrame()
+        if frame is not None and not self.isRepeatFrame(frame):
+            # formatting native python floats is considerably faster than formatting numpy scalars
+            t0 = time.perf_counter()
+            pixels = frame if np is None else frame.tolist()
+
             # go to great lengths to get rid of the spaces, zeros and spurious digits python
             # *really* wants you to have.  We want to send out as few bytes of data as possible.
-            self.pb.ws.send(
-                "{\"setVars\":{\"pixels\":[" + ",".join(f"{x:5g}".lstrip(" ") for x in self.pixels) + "]}}")
-            self.packets_out += 1
-            self.pixelsUpdated = 0
+            self._sendText(
+                "{\"setVars\":{\"pixels\":[" + ",".join(f"{x:5g}".lstrip(" ") for x in pixels) + "]}}", t0)
+            self.frameTransmitted(frame)
+
+    def _changed_ranges(self, frame) -> list:
+        """
+        Find the ranges of pixels that have changed since the last keyframe.  Each delta covers
+        everything since the keyframe, not just the last delta, so the pattern can't lose a change
+        when a new delta overwrites one it hasn't applied yet.
+        :param frame: the frame being sent, as returned by takeFrame()
+        :return: list of (start, end) tuples, or an empty list if nothing has changed since the last frame sent
+        """
+        dirty = self.deltaDirty
+        if np is not None:
+            changed = frame != self.lastSentPixels
+            if not changed.any():
+                return []
+            dirty |= changed
+            idx = np.flatnonzero(dirty)
+            breaks = np.flatnonzero(np.diff(idx) > self.DELTA_MERGE_GAP + 1)
+            starts = np.concatenate((idx[:1], idx[breaks + 1]))
+            ends = np.concatenate((idx[breaks], idx[-1:])) + 1
+            return list(zip(starts.tolist(), ends.tolist()))
+
+        changed = False
+        for i in range(self.pixelCount):
+            if frame[i] != self.lastSentPixels[i]:
+                dirty[i] = changed = True
+        if not changed:
+            return []
+
+        ranges = []
+        start = end = -1
+        for i in range(self.pixelCount):
+            if dirty[i]:
+                if start >= 0 and i - end <= self.DELTA_MERGE_GAP:
+                    end = i + 1
+                else:
+                    if start >= 0:
+                        ranges.append((start, end))
+                    start, end = i, i + 1
+        if start >= 0:
+            ranges.append((start, end))
+        return ranges
+
+    def _send_delta_data(self):
+        """
+        Send only the pixel ranges that have changed since the last keyframe, or a full keyframe if it's
+        time for one, or if so much has changed that a keyframe would be smaller.
+        Delta frames are sent as a flat list of [start, count, pixel values...] records
+        """
+        frame = self.takeFrame()
+        if frame is not None:
+            t0 = time.perf_counter()
+            pixels = frame if np is None else frame.tolist()
+            t = time.time()
+
+            if t < self.nextKeyframe:
+                ranges = self._changed_ranges(frame)
+                if not ranges:
+                    return
+
+                deltaLen = sum(end - start + 2 for start, end in ranges)
+                if deltaLen <= self.pixelCount // 2:
+                    records = ",".join(f"{start},{end - start}," +
+                                       ",".join(f"{x:5g}".lstrip(" ") for x in pixels[start:end])
+                                       for start, end in ranges)
+                    self._sendText(
+                        "{\"setVars\":{\"delta\":[" + records + "],\"deltaLen\":" + str(deltaLen) + "}}", t0)
+                    self.lastSentPixels = frame
+                    self.frameSent()
+                    return
+
+            # send a keyframe. Setting deltaLen to 0 cancels any delta the pattern hasn't applied yet.
+            self._sendText(
+                "{\"setVars\":{\"deltaLen\":0,\"pixels\":[" + ",".join(f"{x:5g}".lstrip(" ") for x in pixels) + "]}}",
+                t0)
+            self.lastSentPixels = frame
+            self.deltaDirty = [False] * self.pixelCount if np is None else np.zeros(self.pixelCount, dtype=bool)
+            self.nextKeyframe = t + self.keyframeInterval
+            self.frameSent()
 
     def _send_channel_data(self):
         """
         Send a frame of DMX channel data to the Pixelblaze as bytes
         """
 
-        if self.pixelsUpdated > 0:
+        frame = self.takeFrame()
+        if frame is not None and not self.isRepeatFrame(frame):
             # go to great lengths to get rid of the spaces, zeros and spurious digits python
             # *really* wants you to have.  We want to send out as few bytes of data as possible.
-            # self.pb.ws.send(
-            self.pb.ws.send(
-                "{\"setVars\":{\"channels\":[" + ",".join(f"{x:d}".lstrip(" ") for x in self.channelData) + "]}}")
+            t0 = time.perf_counter()
+            self._sendText(
+                "{\"setVars\":{\"channels\":[" + ",".join(f"{x:d}".lstrip(" ") for x in frame) + "]}}", t0)
+
+            self.frameTransmitted(frame)
 
-            self.packets_out += 1
-            self.pixelsUpdated = 0
+    def _sendText(self, message: str, encodeStart: float):
+        """
+        Send a text frame to the Pixelblaze, and count its bytes and the time it took to encode
+        :param message: the frame
+        :param encodeStart: perf_counter() time we started building the frame
+        """
+        t = time.perf_counter() - encodeStart
+        self.encodeSeconds += t
+        self.encodes += 1
+        self.bytes_out += len(message)
+        if self.sharedOutput is not None:
+            h = self.sharedOutput
+            h[SharedFrameBuffer.ENCODE_SECONDS] += t
+            h[SharedFrameBuffer.ENCODES] += 1
+            h[SharedFrameBuffer.BYTES_OUT] += len(message)
+        self.pb.ws.send(message)
 
     def getStatusString(self, et):
         """
@@ -187,22 +703,146 @@ class DisplayDevice:
         :param et: elapsed time in seconds
         :return: status string
         """
-        if self.pb is None:
+        return json.dumps(self.getStatus(et))
+
+    def getStatus(self, et) -> dict:
+        """
+        Return a status dictionary for the display device
+        :param et: elapsed time in seconds
+        :return: status dictionary
+        """
+        if self.sharedInput is not None:
+            # our frames are sent by another process, which reports back through the shared buffer
+            self.collectSharedStats()
+            is_connected = "true" if self.sharedInput[SharedFrameBuffer.CONNECTED] else "false"
+        elif self.pb is None:
             is_connected = "false"
         else:
             is_connected = "true" if self.pb.is_connected() else "false"
         inP = round(self.packets_in / et, 1)
         outF = round(self.packets_out / et, 1)
-        return json.dumps({"name": self.name, "inPps": inP, "outFps": outF,
-                           "ip": self.ip, "maxFps": self.maxFps, "connected": is_connected})
+        status = {"name": self.name, "inPps": inP, "outFps": outF,
+                  "lost": self.packets_lost, "stale": self.packets_stale, "skipped": self.frames_skipped,
+                  "ip": self.ip, "maxFps": self.maxFps, "connected": is_connected, "lastError": self.lastError}
+        if self.sharedInput is not None:
+            h = self.sharedInput
+            status.update({"intervalMs": h[SharedFrameBuffer.INTERVAL_MS], "jitterMs": h[SharedFrameBuffer.JITTER_MS],
+                           "maxErrorMs": h[SharedFrameBuffer.MAX_ERROR_MS], "missed": int(h[SharedFrameBuffer.MISSED])})
+        else:
+            status.update(self.pacer.getStats())
+        latency = self.latency.getStats()
+        status.update({"latencyP50Ms": latency["p50Ms"], "latencyP95Ms": latency["p95Ms"],
+                       "latencyP99Ms": latency["p99Ms"], "decodeP99Ms": self.decodeLatency.getStats()["p99Ms"]})
+        return status
+
+    def getLatencyHistograms(self) -> dict:
+        """Return this device's latency statistics and histogram buckets, for export"""
+        if self.sharedInput is not None:
+            self.collectSharedLatency()
+        return {"name": self.name, "latency": self.latency.getStats(), "latencyBuckets": self.latency.toDict(),
+                "decode": self.decodeLatency.getStats(), "decodeBuckets": self.decodeLatency.toDict()}
+
+    def getMetrics(self) -> dict:
+        """
+        Return this device's monotonic counters and current gauges, for the metrics endpoint.
+        Only reads values the send and receive paths already maintain, so it's safe to call at
+        any time, as long as resetCounters() isn't running at the same time.
+        """
+        metrics = {counter: self.totals[counter] + getattr(self, counter) for counter in self.TOTALED_COUNTERS}
+        if self.sharedInput is not None:
+            # the output counters live in the process sending our frames
+            h = self.sharedInput
+            connected = bool(h[SharedFrameBuffer.CONNECTED])
+            bytesOut, encodes = int(h[SharedFrameBuffer.BYTES_OUT]), int(h[SharedFrameBuffer.ENCODES])
+            encodeSeconds, connects = h[SharedFrameBuffer.ENCODE_SECONDS], int(h[SharedFrameBuffer.CONNECTS])
+            self.collectSharedLatency()
+        else:
+            connected = self.pb is not None and self.pb.is_connected()
+            bytesOut, encodes, encodeSeconds, connects = self.bytes_out, self.encodes, self.encodeSeconds, self.connects
+        metrics.update({"bytes_out": bytesOut, "encodes": encodes, "encodeSeconds": encodeSeconds,
+                        "reconnects": max(0, connects - 1), "connected": int(connected),
+                        "latency": self.latency.getStats()})
+        return metrics
+
+    def collectSharedStats(self):
+        """Pick up the output counters maintained by the process sending our frames"""
+        h = self.sharedInput
+        self.packets_out = int(h[SharedFrameBuffer.PACKETS_OUT] - self.lastPacketsOut)
+        self.frames_skipped = int(h[SharedFrameBuffer.SKIPPED] - self.lastSkipped)
+        self.lastPacketsOut = h[SharedFrameBuffer.PACKETS_OUT]
+        self.lastSkipped = h[SharedFrameBuffer.SKIPPED]
+        self.collectSharedLatency()
+
+    def collectSharedLatency(self):
+        """
+        Rebuild the latency histograms from the running totals kept by the process sending our
+        frames, less the totals at the last reset
+        """
+        latency = self.sharedBuffer.latency
+        self.latency.load(latency[0] - self.latencyBaseline[0])
+        self.decodeLatency.load(latency[1] - self.latencyBaseline[1])
 
     def resetCounters(self):
         """
         Reset the packet counters for this display device
         """
+        for counter in self.TOTALED_COUNTERS:
+            self.totals[counter] += getattr(self, counter)
         self.packets_in = 0
         self.packets_out = 0
+        self.packets_lost = 0
+        self.packets_stale = 0
+        self.frames_skipped = 0
         self.pixelsReceived = 0
+        self.pacer.resetStats()
+        self.latency.reset()
+        self.decodeLatency.reset()
+        if self.sharedInput is not None:
+            self.latencyBaseline = self.sharedBuffer.latency.copy()
+
+    def connect(self):
+        """
+        Create the Pixelblaze device object if necessary, and try to open its websocket
+        connection.  This can block for a while, and can fail, in which case we'll
+        try again on the next call.
+        """
+        if self.pb is None:
+            self.pb = Pixelblaze(self.ip)
+            logging.debug("Pixelblaze: %s (%s) initializing." % (self.name, self.ip))
+            logging.debug("Connection is %s" % ("open" if self.pb.is_connected() else "NOT open"))
+        else:
+            self.pb.open()
+
+        # always turn off preview frames to save Pixelblaze CPU and bandwidth
+        if self.pb.is_connected():
+            self.pb.setSendPreviewFrames(False)
+
+    def service(self):
+        """
+        Eat any incoming traffic from the Pixelblaze, and send it a frame if one
+        is ready.  Exceptions are connection errors, and should be passed to connectionLost().
+        """
+        ready = select.select([self.pb.ws.sock], [], [], 0)
+        if ready[0]:
+            self.pb.wsReceive()
+
+        # send any data we've received
+        self.sendMethod()
+        self.pacer.advance()
+
+    def connectionLost(self, e: Exception):
+        """
+        Clean up after a connection error, so we can try to reconnect.
+        :param e: the exception that signalled the error
+        """
+        logging.debug("Pixelblaze %s (%s) stalled or disconnected." % (self.name, self.ip))
+        logging.debug("Exception: %s" % str(e))
+        self.lastError = str(e)
+        if self.pb is not None:
+            self.pb.close()
+
+        # go through the connection setup again when we reconnect
+        self.sendMethod = self._send_pre_init
 
     def run_thread(self):
         """
@@ -211,45 +851,32 @@ class DisplayDevice:
         which means that the object will try to establish the connection on the next
         (and subsequent) attempts to use it.
         """
-        self.pb = Pixelblaze(self.ip)
-        # always turn off preview frames to save Pixelblaze CPU and bandwidth
-        self.pb.setSendPreviewFrames(False)
+        try:
+            self.connect()
+        except Exception as e:
+            self.connectionLost(e)
 
-        logging.debug("Pixelblaze: %s (%s) initializing." % (self.name, self.ip))
-        logging.debug("Connection is %s" % ("open" if self.pb.is_connected() else "NOT open"))
-
-        frame_timer = time.time()
+        self.pacer.restart()
 
         # eat incoming traffic and send data to the Pixelblaze
         while self.run_flag.is_set():
             try:
                 if self.pb.is_connected():
-                    ready = select.select([self.pb.ws.sock], [], [], 0)
-                    if ready[0]:
-                        self.pb.wsReceive()
-
                     # sleep 'till it's time to send a frame
-                    t = time.time()
-                    time.sleep(min(self.sec_per_frame, t - frame_timer))
-                    frame_timer = t
-
-                    # send any data we've received
-                    self.sendMethod()
+                    self.pacer.wait()
+                    self.service()
                 else:
                     # sleep for a short interval. Even though pb.open will only retry every 2 seconds
                     # we can spare the CPU (and the GIL) for a bit to let other threads run.
                     time.sleep(0.25)
-                    self.pb.open()
-                    self.pb.setSendPreviewFrames(False)
+                    self.connect()
+                    self.pacer.restart()
 
             # minimalist exception handling: if we get an exception it is going to be a
             # connection error of some sort, and we'll need to keep trying to reconnect at intervals.
             # TODO - add an exponential backoff timer to the reconnect attempts?
             except Exception as e:
-                logging.debug("Pixelblaze %s (%s) stalled or disconnected." % (self.name, self.ip))
-                logging.debug("Exception: %s" % str(e))
-                self.pb.close()
-                pass
+                self.connectionLost(e)
 
     def stop(self):
         self.run_flag.clear()
@@ -261,4 +888,5 @@ class DisplayDevice:
         return ("DisplayDevice: name: " + self.name + " ip: " + self.ip + " pixelCount: " +
                 str(self.pixelCount) + " maxFps: " + str(self.maxFps) + " pixelsReceived: " +
                 str(self.pixelsReceived) + " packets_in: " + str(self.packets_in) + " packets_out: " +
-                str(self.packets_out) + " run_flag: " + str(self.run_flag.is_set()))
+                str(self.packets_out) + " packets_lost: " + str(self.packets_lost) + " packets_stale: " +
+                str(self.packets_stale) + " run_flag: " + str(self.run_flag.is_set()))
@@ -20,7 +20,10 @@
 """
 import argparse
 import logging
-from ProcessManager import startArtnetRouter
+import os
+
+from ArtnetCapture import ArtnetCapture
+from ProcessManager import startArtnetRouter, stopArtnetRouter
 from ProjectData import ProjectData
 from WebInterface import RemiWrapper
 
@@ -34,11 +37,25 @@ def main():
         level=logging.DEBUG,
         datefmt='%Y-%m-%d %H:%M:%S')
 
-    # use argparse to manage our lone (for now) command line argument -  the project configuration file name,
-    # specified by # --file.  If it's not there, we'll use the default.
+    # use argparse to manage our command line arguments - the project configuration file name,
+    # specified by --file (if it's not there, we'll use the default), and capture recording, replay and show playback.
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", required=False, default="./config/config.conf",
                         help="Path to project configuration file to use.  Default is ./config/config.conf")
+    parser.add_argument("--record", required=False, metavar="CAPTURE",
+                        help="Record all received Art-Net/sACN data to this capture file.  If it exists, "
+                             "recording carries on at its end.")
+    parser.add_argument("--overwrite", required=False, action="store_true",
+                        help="With --record, start a new capture, replacing the existing one.")
+    parser.add_argument("--replay", required=False, metavar="CAPTURE",
+                        help="Replay a capture file through the router, as if it were arriving from a console.")
+    parser.add_argument("--play", required=False, metavar="CAPTURE",
+                        help="Play a recorded show straight to the Pixelblazes, without listening for a console.")
+    parser.add_argument("--loop", required=False, action="store_true",
+                        help="With --play, play the show over and over.")
+    parser.add_argument("--speed", required=False, type=float, default=1.0,
+                        help="Replay and play speed. 1 is real time, 2 twice as fast, 0 as fast as possible.  "
+                             "Default is 1")
     # Parse the command line.
     args = parser.parse_args()
 
@@ -47,6 +64,17 @@ def main():
     pd = ProjectData()
     pd.loadProject(args.file)
     pd.copyLiveToEditable()
+    # the router appends to the capture, so recording carries on across restarts.  Start
+    # with a fresh one only if we're asked to.
+    if args.record and args.overwrite:
+        for fileName in (args.record, ArtnetCapture.indexFileName(args.record)):
+            if os.path.exists(fileName):
+                os.remove(fileName)
+    pd.recordFile = args.record
+    pd.replayFile = args.replay
+    pd.replaySpeed = args.speed
+    pd.playFile = args.play
+    pd.playLoop = args.loop
 
     # create and start the Artnet router in its own process
     startArtnetRouter(pd)
@@ -63,7 +91,7 @@ def main():
         message = "Terminated by unexpected exception: " + str(e)
         logging.error(message)
 
-    pd.routerProcess.join()
+    stopArtnetRouter(pd)
     print("Flamecaster shutting down. Thank you for playing!")
 
 if __name__ == '__main__':
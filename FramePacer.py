@@ -0,0 +1,109 @@
+"""
+FramePacer - keeps a device's output on a steady frame schedule.
+
+Frame deadlines are absolute times on the monotonic clock, so timing errors don't
+accumulate the way they do with "sleep for a frame time" loops.  Also keeps jitter
+statistics, so we can see how evenly spaced the frames actually are.
+"""
+import math
+import time
+from enum import IntEnum
+
+
+class FramePacer:
+    """
+    Computes frame deadlines for a given frame rate, and tracks the actual
+    interval between frames.
+    """
+
+    class LatePolicy(IntEnum):
+        # if we're late, send the missed frame right away and stay on the original schedule
+        CatchUp = 0
+        # if we're late, skip any missed frames and restart the schedule from now
+        Skip = 1
+
+    # in CatchUp mode, never try to catch up more than this many frames
+    MAX_CATCHUP_FRAMES = 2
+
+    def __init__(self, fps: float, policy: LatePolicy = LatePolicy.Skip, phaseAlign: bool = False):
+        """
+        :param fps: target frame rate
+        :param policy: what to do when we miss a deadline
+        :param phaseAlign: if True, deadlines fall on whole multiples of the frame period on the monotonic
+        clock, so all devices with the same frame rate send their frames at the same time.
+        """
+        self.period = 1 / fps
+        self.policy = policy
+        self.phaseAlign = phaseAlign
+        self.deadline = self.align(time.monotonic())
+        self.lastFrame = 0
+        self.resetStats()
+
+    def align(self, t: float) -> float:
+        """Return the first valid deadline at or after time t"""
+        if self.phaseAlign:
+            return math.ceil(t / self.period) * self.period
+        return t
+
+    def restart(self):
+        """Restart the schedule from now, for example after a reconnect"""
+        self.deadline = self.align(time.monotonic())
+        self.lastFrame = 0
+
+    def delay(self) -> float:
+        """Return the time in seconds 'till the next frame is due, or 0 if it's due now"""
+        return max(0.0, self.deadline - time.monotonic())
+
+    def wait(self):
+        """Sleep 'till the next frame is due"""
+        d = self.deadline - time.monotonic()
+        if d > 0:
+            time.sleep(d)
+
+    def frameDone(self):
+        """
+        Call when a frame has actually been sent.  Updates the frame interval and jitter statistics.
+        """
+        t = time.monotonic()
+        if self.lastFrame > 0:
+            interval = t - self.lastFrame
+            self.frames += 1
+            self.intervalSum += interval
+            self.intervalSumSq += interval * interval
+            self.maxError = max(self.maxError, abs(interval - self.period))
+        self.lastFrame = t
+
+    def advance(self):
+        """
+        Call after each pass of the output loop, whether or not it sent a frame.  Moves the
+        deadline on to the next frame.
+        """
+        # If we've already missed the next deadline, either leave it in the past, so the next
+        # frame goes out right away, or skip ahead to the next deadline that's still in the future.
+        t = time.monotonic()
+        self.deadline += self.period
+        late = t - self.deadline
+        if late > 0 and (self.policy == self.LatePolicy.Skip or late > self.MAX_CATCHUP_FRAMES * self.period):
+            skipped = int(late / self.period) + 1
+            self.missed += skipped
+            self.deadline += skipped * self.period
+
+    def resetStats(self):
+        self.frames = 0
+        self.missed = 0
+        self.intervalSum = 0.0
+        self.intervalSumSq = 0.0
+        self.maxError = 0.0
+
+    def getStats(self) -> dict:
+        """
+        Return frame timing statistics since the last reset: mean frame interval, jitter (the standard
+        deviation of the frame interval) and worst-case deviation from the target period, all in
+        milliseconds, plus the number of missed frame deadlines.
+        """
+        if self.frames == 0:
+            return {"intervalMs": 0, "jitterMs": 0, "maxErrorMs": 0, "missed": self.missed}
+        mean = self.intervalSum / self.frames
+        variance = max(0.0, self.intervalSumSq / self.frames - mean * mean)
+        return {"intervalMs": round(mean * 1000, 2), "jitterMs": round(math.sqrt(variance) * 1000, 2),
+                "maxErrorMs": round(self.maxError * 1000, 2), "missed": self.missed}
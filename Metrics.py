@@ -0,0 +1,163 @@
+"""
+Metrics.py - Lightweight latency histograms for the router's hot paths, and an optional
+HTTP endpoint that exposes the router's counters in Prometheus text format.
+
+Samples go into fixed, logarithmically spaced buckets, so recording one costs a
+log() and an increment, memory use doesn't grow, and percentiles are accurate to
+within a bucket width (about 12%).
+"""
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyHistogram:
+    """
+    Histogram of latency samples, in seconds, with log-spaced buckets from MIN_LATENCY up.
+    Anything smaller than MIN_LATENCY goes in the first bucket, anything larger than the
+    top bucket goes in the last.
+    """
+    MIN_LATENCY = 0.00005  # 50us
+    BUCKETS_PER_DOUBLING = 6
+    BUCKET_COUNT = 96  # up to about 3.3 seconds
+    BOUNDS = []  # upper bound of each bucket, in seconds - see below
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket(cls, seconds: float) -> int:
+        """Return the index of the bucket a sample goes in"""
+        if seconds > cls.MIN_LATENCY:
+            return min(int(math.log2(seconds / cls.MIN_LATENCY) * cls.BUCKETS_PER_DOUBLING), cls.BUCKET_COUNT - 1)
+        return 0
+
+    def record(self, seconds: float):
+        self.counts[self.bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def reset(self):
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        Return the latency, in seconds, below which p percent of the samples fall.  The result
+        is the upper bound of the bucket holding that sample, capped at the largest sample seen.
+        """
+        if self.count == 0:
+            return 0.0
+        target = math.ceil(self.count * p / 100)
+        seen = 0
+        for n, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(self.BOUNDS[n], self.max)
+        return self.max
+
+    def getStats(self) -> dict:
+        """Return sample count, mean, p50/p95/p99 and max latency, in milliseconds"""
+        if self.count == 0:
+            return {"count": 0, "meanMs": 0, "p50Ms": 0, "p95Ms": 0, "p99Ms": 0, "maxMs": 0}
+        return {"count": self.count, "meanMs": round(self.total / self.count * 1000, 2),
+                "p50Ms": round(self.percentile(50) * 1000, 2), "p95Ms": round(self.percentile(95) * 1000, 2),
+                "p99Ms": round(self.percentile(99) * 1000, 2), "maxMs": round(self.max * 1000, 2)}
+
+    def load(self, values):
+        """
+        Replace the histogram with one stored in an array of BUCKET_COUNT + 2 values - bucket
+        counts, then sample count and total - as kept by SharedFrameBuffer.recordLatency().  The
+        largest sample isn't stored, so it's taken to be the upper bound of the highest non-empty
+        bucket.
+        """
+        n = self.BUCKET_COUNT
+        self.counts = [int(c) for c in values[:n]]
+        self.count = int(values[n])
+        self.total = float(values[n + 1])
+        top = max((i for i, c in enumerate(self.counts) if c > 0), default=None)
+        self.max = 0.0 if top is None else self.BOUNDS[top]
+
+    def toDict(self) -> dict:
+        """Return the non-empty buckets, as {upper bound in ms: count}, for export"""
+        return {round(self.BOUNDS[n] * 1000, 3): c for n, c in enumerate(self.counts) if c > 0}
+
+
+LatencyHistogram.BOUNDS = [LatencyHistogram.MIN_LATENCY * 2 ** ((n + 1) / LatencyHistogram.BUCKETS_PER_DOUBLING)
+                           for n in range(LatencyHistogram.BUCKET_COUNT)]
+
+
+def formatMetric(name: str, metricType: str, helpText: str, samples: list) -> str:
+    """
+    Format a metric family in Prometheus text exposition format
+    :param name: metric name
+    :param metricType: "counter" or "gauge"
+    :param helpText: description
+    :param samples: list of (labels dict, value) tuples
+    :return: the formatted family, ending with a newline
+    """
+    lines = ["# HELP %s %s" % (name, helpText), "# TYPE %s %s" % (name, metricType)]
+    for labels, value in samples:
+        if labels:
+            labelText = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                                 for k, v in labels.items())
+            lines.append("%s{%s} %s" % (name, labelText, repr(float(value))))
+        else:
+            lines.append("%s %s" % (name, repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves /metrics over HTTP from a daemon thread.  The page is built by a callback when
+    it's requested, so there's no cost at all when nobody is scraping.
+    """
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, ip: str, port: int, render):
+        """
+        :param ip: address to listen on
+        :param port: TCP port to listen on
+        :param render: callback that returns the metrics page as a string
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = server.render().encode("utf-8")
+                except Exception as e:
+                    logging.error("Metrics: unable to render page: " + str(e))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", MetricsServer.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.render = render
+        self.httpd = ThreadingHTTPServer((ip, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
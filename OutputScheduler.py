@@ -0,0 +1,124 @@
+"""
+OutputScheduler - drives the output side of all DisplayDevices from a single
+asyncio event loop running in its own thread, instead of one thread per device.
+
+Each device gets a lightweight task that paces its frames.  Websocket connections are
+opened, and frames sent, in thread pools, since both block.  That way a Pixelblaze that
+is slow to connect, or stalls while we're sending to it, never holds up any of the others.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from DisplayDevice import DisplayDevice
+
+
+class OutputScheduler:
+    """
+    Owns the Pixelblaze connections for a set of DisplayDevices, and schedules
+    their frame output.  Used when the system "outputEngine" setting is "asyncio".
+    """
+    # maximum number of connection attempts that can be in progress at once
+    MAX_CONNECT_WORKERS = 8
+
+    # maximum number of sends that can be in progress at once.  Threads are only started when
+    # all the existing ones are busy, so normally there are only a few of them.
+    MAX_SEND_WORKERS = 64
+
+    # how long to wait between connection attempts for a disconnected device
+    RECONNECT_INTERVAL = 0.25
+
+    loop = None
+    thread = None
+
+    def __init__(self, deviceList: dict):
+        self.deviceList = dict(deviceList)
+        self.tasks = dict()
+        self.running = False
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_CONNECT_WORKERS,
+                                           thread_name_prefix="PixelblazeConnect")
+        self.sendExecutor = ThreadPoolExecutor(max_workers=self.MAX_SEND_WORKERS,
+                                               thread_name_prefix="PixelblazeSend")
+
+    def start(self):
+        """Start the event loop thread, and an output task for every device"""
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.run_loop, name="OutputScheduler", daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        for key in self.deviceList:
+            self.tasks[key] = self.loop.create_task(self.device_task(self.deviceList[key]))
+        self.loop.run_forever()
+
+        # we've been stopped.  Clean up any tasks that are still around.
+        for task in self.tasks.values():
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*self.tasks.values(), return_exceptions=True))
+        self.loop.close()
+
+    async def device_task(self, dd: DisplayDevice):
+        """
+        Maintain a device's websocket connection, and send it frames on the schedule set by its frame pacer.
+        :param dd: the DisplayDevice to drive
+        """
+        loop = asyncio.get_running_loop()
+
+        while self.running and dd.run_flag.is_set():
+            try:
+                if dd.pb is None or not dd.pb.is_connected():
+                    await loop.run_in_executor(self.executor, dd.connect)
+                    if not dd.pb.is_connected():
+                        await asyncio.sleep(self.RECONNECT_INTERVAL)
+                        continue
+                    dd.pacer.restart()
+
+                # wait for the next frame deadline
+                delay = dd.pacer.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                await loop.run_in_executor(self.sendExecutor, dd.service)
+
+            except asyncio.CancelledError:
+                raise
+
+            # as with the device threads, any exception here will be a connection error
+            except Exception as e:
+                dd.connectionLost(e)
+                await asyncio.sleep(self.RECONNECT_INTERVAL)
+
+    def addDevice(self, key, dd: DisplayDevice):
+        """Start driving a new device.  Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._addDevice, key, dd)
+
+    def _addDevice(self, key, dd: DisplayDevice):
+        self.deviceList[key] = dd
+        self.tasks[key] = self.loop.create_task(self.device_task(dd))
+
+    def removeDevice(self, key):
+        """
+        Stop driving a device.  Safe to call from any thread.  The device's task exits on its
+        own once the device is stopped.
+        """
+        self.loop.call_soon_threadsafe(self._removeDevice, key)
+
+    def _removeDevice(self, key):
+        self.deviceList.pop(key, None)
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def stop(self):
+        """Stop all output tasks and the event loop"""
+        self.running = False
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=False)
+        self.sendExecutor.shutdown(wait=False)
+        logging.debug("Output scheduler stopped")
@@ -0,0 +1,85 @@
+"""
+OutputWorker - entry point for output worker processes.
+
+In sharded mode, the ArtnetRouter process receives and decodes Art-Net data
+into shared frame buffers, and the devices are divided up among several output
+worker processes, each of which maintains its devices' Pixelblaze connections and
+sends their frames.  This spreads the (considerable) cost of sending frames
+across multiple CPU cores.
+"""
+import logging
+
+from DisplayDevice import DisplayDevice
+from OutputScheduler import OutputScheduler
+from SharedFrames import SharedFrameBuffer
+
+
+def assignShards(devices: dict, shardCount: int) -> list:
+    """
+    Divide devices among output shards, balancing the total pixel count of each shard.
+    :param devices: dictionary of device configurations
+    :param shardCount: number of shards
+    :return: list of lists of device keys, one per shard
+    """
+    shards = [[] for _ in range(shardCount)]
+    load = [0] * shardCount
+
+    # biggest devices first, each to the least loaded shard
+    for key in sorted(devices, key=lambda k: devices[k].get('pixelCount', 0), reverse=True):
+        n = load.index(min(load))
+        shards[n].append(key)
+        load[n] += max(1, devices[key].get('pixelCount', 0))
+    return shards
+
+
+def output_worker(shard: int, config: dict, deviceKeys: list, bufferNames: dict, exit_flag):
+    """
+    Run the output side of a set of devices 'till the exit flag is set.
+    :param shard: shard number, for logging
+    :param config: project configuration
+    :param deviceKeys: keys of the devices this worker is responsible for
+    :param bufferNames: dictionary of shared frame buffer names, keyed by device key
+    :param exit_flag: Event that tells us when to shut down
+    """
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-6s: %(message)s',
+        level=logging.DEBUG,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    system = config['system']
+    devices = config['devices']
+    deviceList = dict()
+    buffers = []
+    scheduler = None
+
+    try:
+        for key in deviceKeys:
+            dd = DisplayDevice(devices[key], system, startOutput=False)
+            shared = SharedFrameBuffer(DisplayDevice.getOutputBufferSize(devices[key]), bufferNames[key])
+            dd.attachSharedOutput(shared)
+            deviceList[key] = dd
+            buffers.append(shared)
+
+        logging.info("Output shard %d: sending to %d devices" % (shard, len(deviceList)))
+
+        if system['outputEngine'] == "asyncio":
+            scheduler = OutputScheduler(deviceList)
+            scheduler.start()
+        else:
+            for key in deviceList:
+                deviceList[key].startOutputThread()
+
+        # report status through the shared frame buffers every second 'till it's time to go
+        while not exit_flag.wait(1):
+            for key in deviceList:
+                deviceList[key].publishOutputStats()
+
+    except KeyboardInterrupt:
+        pass
+
+    if scheduler is not None:
+        scheduler.stop()
+    for key in deviceList:
+        deviceList[key].stop()
+    for shared in buffers:
+        shared.close()
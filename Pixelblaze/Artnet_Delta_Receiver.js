@@ -0,0 +1,33 @@
+// Delta frame receiver for use with Flamecaster Art-Net to Pixelblaze router
+// Use this pattern with devices that have "deltaFrames" set to true in the
+// Flamecaster configuration file.
+//
+// Flamecaster sends full keyframes in 'pixels', and in between, sends only
+// the pixel ranges that have changed, as a list of [start, count, values...]
+// records in 'delta'.  'deltaLen' is the number of valid entries in 'delta'.
+//
+// Each delta holds every change since the last keyframe, not just the changes
+// since the previous delta.  If a second delta arrives before beforeRender()
+// has applied the first one, the second one replaces it and nothing is lost.
+export var pixels = array(pixelCount)
+export var delta = array(pixelCount)
+export var deltaLen = 0
+
+var i, j, start, n
+export function beforeRender(elapsed) {
+  i = 0
+  while (i < deltaLen) {
+    start = delta[i]; n = delta[i + 1]; i += 2
+    for (j = 0; j < n; j++) {
+      pixels[start + j] = delta[i + j]
+    }
+    i += n
+  }
+  deltaLen = 0
+}
+
+export function render(index) {
+  var p = pixels[index]
+  r = (p >> 8) & 0xff; g = p & 0xff; b = (p * 256 + .5) & 0xff
+  rgb(r /255, g/255, b/255)
+}
@@ -0,0 +1,322 @@
+"""
+PixelblazeEmulator - stands in for Pixelblazes when there's no hardware handy.
+
+Speaks the subset of the Pixelblaze websocket protocol Flamecaster uses: it answers
+getConfig, getVars and ping, sends a stats frame every second like the real thing,
+and accepts pixel frames sent with setVars.  To
+make testing more realistic, each emulated device can add processing delay per
+frame, limit its receive bandwidth the way a busy Wi-Fi link would, and drop its
+connection at regular intervals.
+
+Every emulator listens on its own port, so dozens can run on one machine.  Point a
+Flamecaster device at one by setting its "ip" to "127.0.0.1:<port>".
+
+Usage: python PixelblazeEmulator.py [--count 8] [--base-port 18100] [--pixels 500]
+            [--delay-ms 0] [--bandwidth-kbps 0] [--drop-interval 0] [--config devices.json]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import select
+import socket
+import struct
+import time
+from threading import Thread
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class PixelblazeEmulator:
+    """
+    A single emulated Pixelblaze, listening on host:port.  Each connection is served by its own thread.
+    """
+    # websocket opcodes
+    OP_CONTINUATION = 0
+    OP_TEXT = 1
+    OP_BINARY = 2
+    OP_CLOSE = 8
+    OP_PING = 9
+    OP_PONG = 10
+
+    STATS_INTERVAL = 1.0
+
+    def __init__(self, port: int, name: str = "Pixelblaze", pixelCount: int = 100, host: str = "127.0.0.1",
+                 processingDelayMs: float = 0, bandwidthKbps: float = 0, dropInterval: float = 0):
+        """
+        :param port: TCP port to listen on
+        :param name: device name reported by getConfig
+        :param pixelCount: pixel count reported by getConfig
+        :param host: address to listen on
+        :param processingDelayMs: time to "render" each pixel frame
+        :param bandwidthKbps: maximum receive rate, in kilobits/sec, or 0 for no limit
+        :param dropInterval: drop each connection after this many seconds, or 0 to never drop
+        """
+        self.name = name
+        self.pixelCount = pixelCount
+        self.processingDelay = processingDelayMs / 1000
+        self.bandwidth = bandwidthKbps * 1000 / 8  # bytes/sec
+        self.dropInterval = dropInterval
+
+        # statistics
+        self.frames = 0
+        self.bytesReceived = 0
+        self.connections = 0
+        self.drops = 0
+        self.vars = dict()
+        self.lastFrame = None
+
+        self.running = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(4)
+        self.address = "%s:%d" % (host, port)
+        self.thread = Thread(target=self.accept_loop, name="Emulator-" + name, daemon=True)
+        self.thread.start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                if select.select([self.sock], [], [], 0.2)[0]:
+                    conn, _ = self.sock.accept()
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.connections += 1
+                    Thread(target=self.serve, args=(conn,), daemon=True).start()
+            except (OSError, ValueError):
+                # socket closed underneath us
+                break
+
+    def close(self):
+        """Stop accepting connections.  Connections in progress end at their next message."""
+        self.running = False
+        self.sock.close()
+        self.thread.join()
+
+    def getStats(self) -> dict:
+        return {"name": self.name, "frames": self.frames, "bytes": self.bytesReceived,
+                "connections": self.connections, "drops": self.drops}
+
+    # --- websocket plumbing
+
+    @staticmethod
+    def recv_exactly(conn, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("connection closed by client")
+            buf += chunk
+        return bytes(buf)
+
+    @staticmethod
+    def send_frame(conn, opcode: int, payload: bytes):
+        n = len(payload)
+        if n < 126:
+            header = bytes((0x80 | opcode, n))
+        elif n < 65536:
+            header = bytes((0x80 | opcode, 126)) + n.to_bytes(2, 'big')
+        else:
+            header = bytes((0x80 | opcode, 127)) + n.to_bytes(8, 'big')
+        conn.sendall(header + payload)
+
+    def send_json(self, conn, message: dict):
+        self.send_frame(conn, self.OP_TEXT, json.dumps(message, separators=(',', ':')).encode())
+
+    @staticmethod
+    def handshake(conn) -> bool:
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+        for line in request.split(b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+                accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+                conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                             b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+                return True
+        return False
+
+    def read_message(self, conn):
+        """
+        Read one complete (possibly fragmented) websocket message
+        :return: tuple of (opcode, payload)
+        """
+        opcode = None
+        message = b''
+        while True:
+            b0, b1 = self.recv_exactly(conn, 2)
+            n = b1 & 0x7f
+            if n == 126:
+                n = int.from_bytes(self.recv_exactly(conn, 2), 'big')
+            elif n == 127:
+                n = int.from_bytes(self.recv_exactly(conn, 8), 'big')
+            mask = self.recv_exactly(conn, 4) if b1 & 0x80 else None
+            payload = self.recv_exactly(conn, n)
+            if mask is not None:
+                payload = (int.from_bytes(payload, 'big') ^
+                           int.from_bytes((mask * (n // 4 + 1))[:n], 'big')).to_bytes(n, 'big')
+            self.bytesReceived += 2 + n
+
+            # control frames can arrive in the middle of a fragmented message
+            if b0 & 0x0f >= self.OP_CLOSE:
+                return b0 & 0x0f, payload
+            if opcode is None:
+                opcode = b0 & 0x0f
+            message += payload
+            if b0 & 0x80:
+                return opcode, message
+
+    # --- the "Pixelblaze"
+
+    def serve(self, conn):
+        connected = time.monotonic()
+        nextStats = connected + self.STATS_INTERVAL
+        nextFree = connected
+        try:
+            if not self.handshake(conn):
+                return
+
+            while self.running:
+                now = time.monotonic()
+                if self.dropInterval > 0 and now - connected >= self.dropInterval:
+                    # reset the connection, rather than closing it politely, like a Wi-Fi dropout would
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    self.drops += 1
+                    return
+
+                # send a stats frame every so often, like a real Pixelblaze
+                if now >= nextStats:
+                    self.send_json(conn, {"fps": 0, "vmerr": 0, "vmerrpc": -1, "mem": 10000,
+                                          "exp": 0, "renderType": 1, "uptime": int((now - connected) * 1000),
+                                          "storageUsed": 0, "storageSize": 0, "rr0": 0, "rr1": 0,
+                                          "rebootCounter": 0})
+                    nextStats += self.STATS_INTERVAL
+                if not select.select([conn], [], [], max(0.0, nextStats - now))[0]:
+                    continue
+
+                before = self.bytesReceived
+                opcode, payload = self.read_message(conn)
+
+                # pretend the message took a while to arrive over a slow link
+                if self.bandwidth > 0:
+                    nextFree = max(nextFree, now) + (self.bytesReceived - before) / self.bandwidth
+                    delay = nextFree - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if opcode == self.OP_TEXT:
+                    self.handle_text(conn, payload)
+                elif opcode == self.OP_PING:
+                    self.send_frame(conn, self.OP_PONG, payload)
+                elif opcode == self.OP_CLOSE:
+                    self.send_frame(conn, self.OP_CLOSE, b'')
+                    return
+
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def handle_text(self, conn, payload: bytes):
+        try:
+            command = json.loads(payload)
+        except ValueError:
+            return
+
+        if "setVars" in command:
+            self.vars.update(command["setVars"])
+            if "pixels" in command["setVars"]:
+                self.pixelFrame(command["setVars"]["pixels"])
+        elif "getConfig" in command:
+            self.send_json(conn, {"name": self.name, "brandName": "", "pixelCount": self.pixelCount,
+                                  "brightness": 1, "maxBrightness": 100, "colorOrder": "BGR",
+                                  "dataSpeed": 3500000, "ledType": 2, "sequenceTimer": 15,
+                                  "sequencerMode": 0, "runSequencer": False, "simpleUiMode": False,
+                                  "discoveryEnable": False, "timezone": "", "autoOffEnable": False,
+                                  "ver": "3.40"})
+            self.send_json(conn, {"activeProgram": {"name": "Artnet Receiver", "activeProgramId": "emulated",
+                                                    "controls": {}}, "sequencerMode": 0, "runSequencer": False})
+        elif "getVars" in command:
+            self.send_json(conn, {"vars": self.vars})
+        elif "ping" in command:
+            self.send_json(conn, {"ack": 1})
+
+    def pixelFrame(self, frame):
+        self.lastFrame = frame
+        self.frames += 1
+        if self.processingDelay > 0:
+            time.sleep(self.processingDelay)
+
+
+def startEmulators(count: int, basePort: int, pixelCount: int, **kwargs) -> list:
+    """
+    Start a set of emulated Pixelblazes on consecutive ports
+    :param count: number of emulators
+    :param basePort: port of the first emulator
+    :param pixelCount: pixel count for each emulator
+    :param kwargs: other PixelblazeEmulator settings
+    :return: list of PixelblazeEmulators
+    """
+    return [PixelblazeEmulator(basePort + n, "emulator%d" % n, pixelCount, **kwargs) for n in range(count)]
+
+
+def deviceConfig(emulators: list, pixelsPerUniverse: int = 170) -> dict:
+    """
+    Build a Flamecaster "devices" section for a set of emulators, with universes assigned in order
+    :param emulators: list of PixelblazeEmulators
+    :param pixelsPerUniverse: pixels per universe
+    :return: devices dictionary
+    """
+    devices = dict()
+    universe = 0
+    for n, em in enumerate(emulators):
+        data = dict()
+        for i, dest in enumerate(range(0, em.pixelCount, pixelsPerUniverse)):
+            data[str(i)] = {"net": 0, "subnet": 0, "universe": universe, "startChannel": 0,
+                            "destIndex": dest, "pixelCount": min(pixelsPerUniverse, em.pixelCount - dest)}
+            universe += 1
+        devices["pb%d" % n] = {"name": em.name, "ip": em.address, "pixelCount": em.pixelCount,
+                               "maxFps": 30, "data": data}
+    return devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run emulated Pixelblazes")
+    parser.add_argument("--count", type=int, default=8, help="Number of emulated Pixelblazes")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--base-port", type=int, default=18100, help="Port of the first emulator")
+    parser.add_argument("--pixels", type=int, default=500, help="Pixels per emulator")
+    parser.add_argument("--delay-ms", type=float, default=0, help="Processing delay per frame, in ms")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="Receive bandwidth limit, 0 for none")
+    parser.add_argument("--drop-interval", type=float, default=0,
+                        help="Drop connections after this many seconds, 0 to never drop")
+    parser.add_argument("--config", help="Write a Flamecaster configuration for the emulators to this file")
+    args = parser.parse_args()
+
+    emulators = startEmulators(args.count, args.base_port, args.pixels, host=args.host,
+                               processingDelayMs=args.delay_ms, bandwidthKbps=args.bandwidth_kbps,
+                               dropInterval=args.drop_interval)
+    if args.config:
+        with open(args.config, "w") as f:
+            json.dump({"devices": deviceConfig(emulators)}, f, indent=4)
+        print("Wrote configuration for %d emulated Pixelblazes to %s" % (len(emulators), args.config))
+
+    print("%d emulated Pixelblazes listening on %s ports %d-%d.  Ctrl-C to stop." %
+          (len(emulators), args.host, args.base_port, args.base_port + len(emulators) - 1))
+    try:
+        while True:
+            time.sleep(5)
+            print("  ".join("%s: %d frames" % (em.name, em.frames) for em in emulators))
+    except KeyboardInterrupt:
+        pass
+
+    for em in emulators:
+        em.close()
+
+
+if __name__ == '__main__':
+    main()
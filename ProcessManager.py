@@ -1,8 +1,27 @@
+import copy
+import logging
 import time
 from multiprocessing import Process
 
 from ArtnetRouter import ArtnetRouter
+from ConfigParser import ConfigParser
+from DisplayDevice import DisplayDevice, FrameStore, SharedFrameBuffer
+from OutputWorker import assignShards, output_worker
 from ProjectData import ProjectData
+from StatsTable import StatsTable
+
+# output worker processes and their shared frame buffers, when running in sharded mode
+outputWorkers = []
+frameBuffers = []
+
+# shared memory stores for each device's latest complete frame, keyed by device key.  Only
+# created if the system "frameStores" setting is true.
+frameStores = dict()
+
+# shared memory status table, written by the router and read by the web UI.  We leave
+# room for devices to be added while the router is running.
+statsTable = None
+MIN_STATS_TABLE_ROWS = 64
 
 
 # noinspection PyShadowingNames
@@ -15,19 +34,134 @@ def mirror_process(pd: ProjectData):
     """
     ArtnetRouter(pd)
 
+def createStatsTable(pd: ProjectData):
+    global statsTable
+    statsTable = StatsTable(max(MIN_STATS_TABLE_ROWS, 2 * len(pd.liveConfig['devices'])))
+    pd.statsTableName = statsTable.name
+
+def closeStatsTable(pd: ProjectData):
+    global statsTable
+    if statsTable is not None:
+        statsTable.close()
+        statsTable = None
+    pd.statsTableName = None
+
+def createFrameStores(pd: ProjectData, keys=None):
+    """
+    Create a frame store for each device, which the router will publish complete frames to.
+    Other processes can attach to them through ProjectData.attachFrameStore().  Publishing
+    costs the router a copy of every frame, so there are only frame stores if the system
+    "frameStores" setting asks for them.
+    :param keys: keys of the devices that need frame stores, or None for all devices
+    :return: dictionary of the new frame stores' names, keyed by device key
+    """
+    if FrameStore is None or not pd.liveConfig['system'].get('frameStores', False):
+        return dict()
+
+    devices = pd.liveConfig['devices']
+    names = dict()
+    for key in (devices if keys is None else keys):
+        store = FrameStore(DisplayDevice.getOutputBufferSize(devices[key]))
+        frameStores[key] = store
+        names[key] = store.name
+    pd.frameStoreNames.update(names)
+    return names
+
+def closeFrameStores(pd: ProjectData, keys=None):
+    """
+    Remove frame stores.  Processes that are still attached to them can keep using them
+    'till they detach.
+    :param keys: keys of the devices whose frame stores should be removed, or None for all devices
+    """
+    for key in list(frameStores if keys is None else keys):
+        store = frameStores.pop(key, None)
+        if store is not None:
+            store.close()
+        pd.frameStoreNames.pop(key, None)
+
+def startOutputShards(pd: ProjectData):
+    """
+    If the system "outputShards" setting is non-zero, create a shared frame buffer for
+    each device, and start the output worker processes that will send their frames.
+    """
+    shards = pd.liveConfig['system'].get('outputShards', 0)
+    devices = pd.liveConfig['devices']
+    if shards <= 0 or len(devices) == 0:
+        return
+
+    if SharedFrameBuffer is None:
+        logging.warning("Sharded output requires numpy.  All devices will run in the router process.")
+        return
+
+    for key in devices:
+        shared = SharedFrameBuffer(DisplayDevice.getOutputBufferSize(devices[key]))
+        frameBuffers.append(shared)
+        pd.frameBufferNames[key] = shared.name
+
+    for n, keys in enumerate(assignShards(devices, min(shards, len(devices)))):
+        p = Process(target=output_worker, name="OutputWorker%d" % n,
+                    args=(n, pd.liveConfig, keys, pd.frameBufferNames, pd.exit_flag))
+        p.daemon = True
+        p.start()
+        outputWorkers.append(p)
+
+def stopOutputShards(pd: ProjectData):
+    for p in outputWorkers:
+        p.join()
+    outputWorkers.clear()
+
+    for shared in frameBuffers:
+        shared.close()
+    frameBuffers.clear()
+    pd.frameBufferNames = dict()
+
 def stopArtnetRouter(pd: ProjectData):
     pd.exit_flag.set()
     pd.routerProcess.join()
+    stopOutputShards(pd)
+    closeFrameStores(pd)
+    closeStatsTable(pd)
 
 def startArtnetRouter(pd: ProjectData):
     pd.exit_flag.clear()
     pd.ui_is_active.clear()
 
+    # shared memory and output workers (if any) need to be ready before the router starts
+    createStatsTable(pd)
+    createFrameStores(pd)
+    startOutputShards(pd)
+
     pd.routerProcess = Process(target=mirror_process, name="ArtnetRouter", args=(pd,))
     pd.routerProcess.daemon = True
     pd.startTime = time.time()
     pd.routerProcess.start()
 
+def reconfigureArtnetRouter(pd: ProjectData, newConfig: dict):
+    """
+    Make newConfig the live configuration.  If only devices have changed, the running router
+    applies the change on the fly, and only the affected devices lose their connections.  Changes
+    to system settings, or to a sharded setup, need a full restart.
+    :param newConfig: the new configuration
+    """
+    newConfig = copy.deepcopy(newConfig)
+    diff = ConfigParser.diff(pd.liveConfig, newConfig)
+
+    if pd.routerProcess is None or not pd.routerProcess.is_alive() or diff.systemChanged or \
+            len(pd.frameBufferNames) > 0 or \
+            statsTable is None or len(newConfig.get('devices', dict())) > statsTable.capacity:
+        pd.liveConfig = newConfig
+        restartArtnetRouter(pd)
+        return
+
+    pd.liveConfig = newConfig
+    if diff.isEmpty():
+        return
+
+    # rebuilt devices get new frame stores, since their frame size may have changed
+    closeFrameStores(pd, diff.devicesRemoved + list(diff.devicesChanged))
+    names = createFrameStores(pd, diff.rebuiltDevices())
+    pd.cmdQueue.put({"cmd": "reconfigure", "config": newConfig, "frameStores": names})
+
 def restartArtnetRouter(pd: ProjectData):
     stopArtnetRouter(pd)
     time.sleep(1)
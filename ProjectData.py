@@ -1,9 +1,16 @@
+import copy
 import time
 
 from multiprocessing import Event, Queue
 from typing import Union
 
 from ConfigParser import ConfigParser
+from StatsTable import StatsTable
+
+try:
+    from SharedFrames import FrameStore
+except ImportError:
+    FrameStore = None
 
 
 """
@@ -16,11 +23,18 @@ class ProjectData:
         self.editableConfig = None
         self.projectFile = None
         self.routerProcess = None
+        self.frameBufferNames = dict()
+        self.frameStoreNames = dict()
+        self.statsTableName = None
+        self.recordFile = None
+        self.replayFile = None
+        self.replaySpeed = 1.0
+        self.playFile = None
+        self.playLoop = False
         self.startTime = 0
         self.bytesIn = 0
         self.bytesOut = 0
         self.cmdQueue = Queue()
-        self.dataQueue = Queue()
         self.exit_flag = Event()
         self.ui_is_active = Event()
 
@@ -28,7 +42,7 @@ class ProjectData:
         """
         Copy the live configuration to the editable configuration.
         """
-        self.editableConfig = self.liveConfig.copy()
+        self.editableConfig = copy.deepcopy(self.liveConfig)
 
     def loadProject(self,filePath: Union[str, None] = None):
         """
@@ -59,7 +73,7 @@ class ProjectData:
         """
         Revert the editable project configuration to the current live state.
         """
-        self.editableConfig = self.liveConfig.copy()
+        self.editableConfig = copy.deepcopy(self.liveConfig)
 
     def revertToSaved(self):
         """
@@ -75,6 +89,28 @@ class ProjectData:
         self.editableConfig = dict()
         ConfigParser.setSystemDefaults(self.editableConfig)
 
+    def attachFrameStore(self, key: str):
+        """
+        Attach to the shared memory frame store holding the latest complete frame for a device.
+        Works from any process.  The caller should close() the store when done with it.
+        :param key: device key
+        :return: FrameStore, or None if there isn't one for the device
+        """
+        name = self.frameStoreNames.get(key)
+        if name is None or FrameStore is None:
+            return None
+        return FrameStore(name=name)
+
+    def attachStatsTable(self):
+        """
+        Attach to the shared memory table of device and router status information.
+        The caller should close() the table when done with it.
+        :return: StatsTable, or None if the router isn't running
+        """
+        if self.statsTableName is None:
+            return None
+        return StatsTable(name=self.statsTableName)
+
     def getUptime(self):
         """
         Returns the number of seconds since the application started.
@@ -0,0 +1,295 @@
+"""
+SacnServer.py - A minimal sACN (ANSI E1.31) receiver for Flamecaster.
+
+Joins the multicast groups for just the universes the configuration uses, picks
+the highest priority source for each universe, and hands DMX data to the same
+dispatch callbacks the Art-Net server uses, so the rest of the router doesn't
+need to know which protocol the data arrived on.
+
+sACN universes are numbered from 1, Art-Net Port-Addresses from 0, so by default
+sACN universe 1 feeds Port-Address 0 (net 0, subnet 0, universe 0).  The offset is
+configurable.
+"""
+
+import logging
+import select
+import socket
+import time
+from threading import Thread
+
+
+class SacnServer:
+    """
+    sACN receiver.  Supports data packets from multiple sources with priority
+    arbitration, stream termination and E1.31 synchronization packets.
+    """
+    UDP_PORT = 5568
+    MAX_UNIVERSE = 63999
+
+    # a source that hasn't sent data on a universe for this long (E1.31 section 6.7.1)
+    # no longer holds it, and lower priority sources can take over.
+    SOURCE_TIMEOUT = 2.5
+
+    # receive buffers are the same as the Art-Net server's zero-copy mode.  Data passed to
+    # the callbacks remains valid until RING_SIZE more packets have been received.
+    RING_SIZE = 64
+    BUFFER_SIZE = 704
+
+    RECEIVE_TIMEOUT = 0.5
+
+    # packet layout.  We check just enough of it to be sure we have a DMX data packet.
+    ACN_PACKET_IDENTIFIER = b'ASC-E1.17\x00\x00\x00'
+    VECTOR_ROOT_DATA = b'\x00\x00\x00\x04'
+    VECTOR_ROOT_EXTENDED = b'\x00\x00\x00\x08'
+    VECTOR_FRAMING_DATA = b'\x00\x00\x00\x02'
+    VECTOR_FRAMING_SYNC = b'\x00\x00\x00\x01'
+    OPTION_PREVIEW = 0x80
+    OPTION_TERMINATED = 0x40
+    HEADER_SIZE = 126  # DMX data (after the start code) starts here
+
+    # parse() results that aren't Port-Addresses
+    DROP = -1
+    SYNC = -2
+
+    def __init__(self, listen_ip: str, universes, callback, batchCallback=None, syncCallback=None,
+                 universeOffset: int = 1, clock=None, recorder=None):
+        """
+        Initializes the sACN server.
+        :param listen_ip: IP address of the interface to receive multicast on, or 0.0.0.0 for the default
+        :param universes: iterable of sACN universe numbers to join
+        :param callback: called with (Port-Address, data) for each DMX packet
+        :param batchCallback: if given, pending packets are drained from the socket and passed to
+        batchCallback as a list of (Port-Address, data) tuples instead.
+        :param syncCallback: called, with no arguments, when a synchronization packet arrives
+        :param universeOffset: sACN universe number that maps to Port-Address 0
+        :param clock: object whose receiveTime attribute is set to the perf_counter() time each
+        packet (or batch of packets) arrives.  Defaults to the server itself.
+        :param recorder: CaptureRecorder to record every packet we dispatch to, or None
+        """
+        self.listen = True
+        self.listen_ip = listen_ip
+        self.callback = callback
+        self.batchCallback = batchCallback
+        self.syncCallback = syncCallback
+        self.universeOffset = universeOffset
+        self.clock = self if clock is None else clock
+        self.recorder = recorder
+        self.receiveTime = 0.0
+        self.packetCount = 0
+        self.batchSizes = [0] * (self.RING_SIZE + 1)
+
+        # per universe source arbitration.  sources[universe] is [source CID, priority, last packet time]
+        self.sources = dict()
+        self.sourcesIgnored = 0
+
+        # sequence tracking, kept for the current source only.  Lost and stale packet counters
+        # are keyed by Port-Address, like the Art-Net server's.
+        self.lastSequence = bytearray(self.MAX_UNIVERSE + 1)
+        self.packetsLost = dict()
+        self.packetsStale = dict()
+
+        # the socket is created here rather than in the receive thread, so setUniverses()
+        # can be called as soon as we're constructed.
+        self.socket_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # multicast only reaches sockets bound to the wildcard address on most platforms
+        self.socket_server.bind(("", self.UDP_PORT))
+        self.universes = set()
+        self.setUniverses(universes)
+
+        self.server_thread = Thread(target=self.__receive, daemon=True)
+        self.server_thread.start()
+
+    @staticmethod
+    def multicastAddress(universe: int) -> str:
+        return "239.255.%d.%d" % (universe >> 8, universe & 255)
+
+    def __membership(self, universe: int) -> bytes:
+        return socket.inet_aton(self.multicastAddress(universe)) + socket.inet_aton(self.listen_ip)
+
+    @property
+    def name(self) -> str:
+        """Name of the interface we're listening on, for status reports"""
+        return "sacn/%s:%d" % (self.listen_ip, self.UDP_PORT)
+
+    def setUniverses(self, universes):
+        """
+        Join the multicast groups for a new set of universes, and leave the ones we no longer need.
+        Unicast sACN is received for any universe.
+        :param universes: iterable of sACN universe numbers
+        """
+        universes = {u for u in universes if 1 <= u <= self.MAX_UNIVERSE}
+        for u in self.universes - universes:
+            try:
+                self.socket_server.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, self.__membership(u))
+            except OSError:
+                pass
+            self.sources.pop(u, None)
+        for u in universes - self.universes:
+            try:
+                self.socket_server.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self.__membership(u))
+            except OSError as e:
+                # keep going - we can still receive unicast on this universe
+                logging.warning("sACN: unable to join multicast group for universe %d: %s" % (u, str(e)))
+        self.universes = universes
+
+    def __receive(self):
+        """
+        Zero-copy receive loop.  Waits for a packet, then, in batch mode, drains any other
+        pending packets from the socket before dispatching them.
+        """
+        ring = [bytearray(self.BUFFER_SIZE) for _ in range(self.RING_SIZE)]
+        views = [memoryview(buf) for buf in ring]
+        sock = self.socket_server
+        recv_into = sock.recvfrom_into
+        batch = [] if self.batchCallback is not None else None
+        slot = 0
+
+        # see ArtnetServer.__receive_batch for why there's no socket timeout
+        dontwait = getattr(socket, 'MSG_DONTWAIT', 0)
+        sock.settimeout(None)
+
+        while self.listen:
+            if not select.select([sock], [], [], self.RECEIVE_TIMEOUT)[0]:
+                continue
+            try:
+                nbytes, _ = recv_into(ring[slot])
+            except OSError:
+                continue
+            now = time.perf_counter()
+            self.clock.receiveTime = now
+
+            while True:
+                addr = self.parse(ring[slot], nbytes, now)
+                if addr >= 0:
+                    count = (ring[slot][123] << 8 | ring[slot][124]) - 1
+                    data = views[slot][self.HEADER_SIZE:min(nbytes, self.HEADER_SIZE + count)]
+                    slot = (slot + 1) % self.RING_SIZE
+                    if batch is None:
+                        self.packetCount += 1
+                        if self.recorder is not None:
+                            self.recorder.record(addr, data)
+                        self.callback(addr, data)
+                    else:
+                        batch.append((addr, data))
+                elif addr == self.SYNC:
+                    # synchronization applies to the data received before it
+                    if batch:
+                        self.__dispatch_batch(batch)
+                    if self.recorder is not None:
+                        self.recorder.recordSync()
+                    if self.syncCallback is not None:
+                        self.syncCallback()
+
+                if batch is None or len(batch) >= self.RING_SIZE:
+                    break
+                try:
+                    if dontwait:
+                        nbytes, _ = recv_into(ring[slot], 0, dontwait)
+                    elif select.select([sock], [], [], 0)[0]:
+                        nbytes, _ = recv_into(ring[slot])
+                    else:
+                        break
+                except (BlockingIOError, InterruptedError, socket.timeout):
+                    break
+
+            if batch:
+                self.__dispatch_batch(batch)
+
+        sock.close()
+
+    def __dispatch_batch(self, batch: list):
+        self.packetCount += len(batch)
+        self.batchSizes[len(batch)] += 1
+        if self.recorder is not None:
+            self.recorder.recordBatch(batch)
+        self.batchCallback(batch)
+        batch.clear()
+
+    def parse(self, buf: bytearray, nbytes: int, now: float) -> int:
+        """
+        Check a received packet, and decide whether its data should be used.
+        :return: the Port-Address to dispatch the packet's data to, SYNC for a synchronization
+        packet, or DROP
+        """
+        if nbytes < 49 or buf[4:16] != self.ACN_PACKET_IDENTIFIER:
+            return self.DROP
+
+        if buf[18:22] == self.VECTOR_ROOT_EXTENDED:
+            return self.SYNC if buf[40:44] == self.VECTOR_FRAMING_SYNC else self.DROP
+
+        if nbytes <= self.HEADER_SIZE or buf[18:22] != self.VECTOR_ROOT_DATA or \
+                buf[40:44] != self.VECTOR_FRAMING_DATA or buf[125] != 0:
+            return self.DROP
+        options = buf[112]
+        if options & self.OPTION_PREVIEW:
+            return self.DROP
+        universe = buf[113] << 8 | buf[114]
+        addr = universe - self.universeOffset
+        if not 0 <= addr < 32768:
+            return self.DROP
+
+        # the highest priority source that's still sending owns the universe
+        cid = bytes(buf[22:38])
+        priority = buf[108]
+        source = self.sources.get(universe)
+        if source is None or source[0] != cid:
+            if source is not None and priority <= source[1] and now - source[2] < self.SOURCE_TIMEOUT:
+                self.sourcesIgnored += 1
+                return self.DROP
+            if options & self.OPTION_TERMINATED:
+                return self.DROP
+            self.sources[universe] = [cid, priority, now]
+            self.lastSequence[universe] = buf[111]
+            return addr
+
+        if options & self.OPTION_TERMINATED:
+            # the source is going away.  Let anybody else have the universe right away.
+            del self.sources[universe]
+            return self.DROP
+        source[1] = priority
+        source[2] = now
+
+        # E1.31 section 6.7.2: a packet up to 20 steps behind the last one is out of order
+        seq = buf[111]
+        delta = (seq - self.lastSequence[universe]) & 255
+        if delta == 0 or delta > 236:
+            self.packetsStale[addr] = self.packetsStale.get(addr, 0) + 1
+            return self.DROP
+        if 1 < delta <= 128:
+            self.packetsLost[addr] = self.packetsLost.get(addr, 0) + delta - 1
+        self.lastSequence[universe] = seq
+        return addr
+
+    def getSequenceStats(self, addresses) -> tuple:
+        """
+        Return the total number of (lost, stale) packets on a set of Port-Addresses since the last reset
+        :param addresses: iterable of Port-Addresses
+        :return: (lost, stale) tuple
+        """
+        lost = self.packetsLost
+        stale = self.packetsStale
+        return sum(lost.get(a, 0) for a in addresses), sum(stale.get(a, 0) for a in addresses)
+
+    def resetSequenceStats(self):
+        """Reset the lost and stale packet counters for all Port-Addresses"""
+        self.packetsLost = dict()
+        self.packetsStale = dict()
+
+    def resetBatchSizes(self):
+        """
+        Return the batch size distribution since the last reset as a dictionary of
+        {batch size: number of batches}, and start counting again.
+        """
+        sizes = self.batchSizes
+        self.batchSizes = [0] * (self.RING_SIZE + 1)
+        return {n: count for n, count in enumerate(sizes) if count > 0}
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Stop the receive thread, which closes the socket on its way out."""
+        self.listen = False
+        if self.server_thread.is_alive():
+            self.server_thread.join()
@@ -0,0 +1,233 @@
+"""
+SharedFrames.py - Shared memory frame buffers, which let a display device's
+output buffer live in memory shared between processes.  The Art-Net router packs
+incoming data straight into the shared buffer, and an output worker process
+sends it to the Pixelblaze, with no copying or pickling in between.
+
+Also home to FrameStore, which makes each device's latest complete frame
+available to any process that wants to look at it.
+
+Requires numpy.
+"""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from Metrics import LatencyHistogram
+
+
+class SharedFrameBuffer:
+    """
+    A block of shared memory holding a small header of counters and status values,
+    followed by a device's output buffer, then a frame area of the same size.  The buffer
+    is created by the main process, and attached by name in the router and output worker
+    processes.
+
+    The router decodes packets straight into the output buffer.  For devices that only send
+    complete frames, it also copies each frame to the frame area as it completes, so the
+    output worker never sends a frame the next one has partly overwritten.  The frame area
+    is guarded by a sequence counter, which is odd while a copy is in progress.
+    """
+    # header slots.  The writer (the router) maintains the update and frame counters, the
+    # reader (the output worker) maintains the rest.
+    UPDATES = 0  # incremented for every packet of data written to the buffer
+    FRAMES = 1  # incremented for every complete frame
+    PACKETS_OUT = 2  # number of frames sent to the Pixelblaze
+    SKIPPED = 3  # number of repeated frames not sent
+    CONNECTED = 4  # 1 if the Pixelblaze is connected, 0 otherwise
+    INTERVAL_MS = 5  # output frame pacer statistics
+    JITTER_MS = 6
+    MAX_ERROR_MS = 7
+    MISSED = 8
+    FRAME_SEQUENCE = 9  # incremented before and after each copy to the frame area
+    RECEIVE_TIME = 10  # perf_counter() time the oldest data in the current frame arrived
+    DECODE_TIME = 11  # perf_counter() time that data was decoded
+    BYTES_OUT = 12  # bytes of frame data sent to the Pixelblaze
+    ENCODES = 13  # number of text frames encoded
+    ENCODE_SECONDS = 14  # time spent encoding them
+    CONNECTS = 15  # number of times the Pixelblaze connected
+    HEADER_SLOTS = 16
+
+    # after the header slots, the output worker keeps running totals of its send and decode
+    # latency histograms - bucket counts, then sample count and total (see recordLatency()).
+    LATENCY_SLOTS = LatencyHistogram.BUCKET_COUNT + 2
+    HEADER_SIZE = (HEADER_SLOTS + 2 * LATENCY_SLOTS) * 8
+
+    def __init__(self, size: int, name: str = None):
+        """
+        Create a new shared frame buffer, or attach to an existing one.
+        :param size: size of the output buffer in bytes
+        :param name: name of the shared memory block to attach to, or None to create a new one
+        """
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner,
+                                              size=self.HEADER_SIZE + 2 * max(1, size))
+
+        self.header = np.ndarray(self.HEADER_SLOTS, dtype=np.float64, buffer=self.shm.buf)
+        self.latency = np.ndarray((2, self.LATENCY_SLOTS), dtype=np.float64, buffer=self.shm.buf,
+                                  offset=self.HEADER_SLOTS * 8)
+        self.data = np.ndarray(size, dtype=np.uint8, buffer=self.shm.buf, offset=self.HEADER_SIZE)
+        self.frame = np.ndarray(size, dtype=np.uint8, buffer=self.shm.buf, offset=self.HEADER_SIZE + max(1, size))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def writeFrame(self, receiveTime: float, decodeTime: float):
+        """
+        Copy the output buffer to the frame area.  Only the router may write frames.
+        :param receiveTime: perf_counter() time the oldest data in the frame arrived
+        :param decodeTime: perf_counter() time that data was decoded
+        """
+        h = self.header
+        h[self.FRAME_SEQUENCE] += 1
+        self.frame[:] = self.data
+        h[self.RECEIVE_TIME] = receiveTime
+        h[self.DECODE_TIME] = decodeTime
+        h[self.FRAME_SEQUENCE] += 1
+
+    def recordLatency(self, send: float, decode: float):
+        """
+        Add a sent frame's latencies to the shared histograms.  Only the output worker may record.
+        :param send: seconds from the arrival of the frame's oldest data to the send
+        :param decode: seconds from that arrival to the end of decoding
+        """
+        n = LatencyHistogram.BUCKET_COUNT
+        for h, seconds in zip(self.latency, (send, decode)):
+            h[LatencyHistogram.bucket(seconds)] += 1
+            h[n] += 1
+            h[n + 1] += seconds
+
+    def readFrame(self):
+        """
+        Return a consistent copy of the frame area, waiting for the router to finish writing if
+        it's in the middle of a copy.
+        :return: tuple of (frame, receive time, decode time)
+        """
+        h = self.header
+        out = np.empty_like(self.frame)
+        while True:
+            seq = h[self.FRAME_SEQUENCE]
+            if seq % 2 == 0:
+                out[:] = self.frame
+                receiveTime = h[self.RECEIVE_TIME]
+                decodeTime = h[self.DECODE_TIME]
+                if h[self.FRAME_SEQUENCE] == seq:
+                    return out, receiveTime, decodeTime
+            time.sleep(0)
+
+    def close(self):
+        """Detach from the shared memory block, and remove it if we created it."""
+        self.header = None
+        self.latency = None
+        self.data = None
+        self.frame = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # somebody still has a view of the buffer.  It'll be released when the process exits.
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+class FrameStore:
+    """
+    A double-buffered, shared memory store for a device's most recent complete frame.
+
+    The Art-Net router publishes each frame as it completes, and any other process - the web
+    UI, a recorder, etc. - can attach by name and read it without pickling or queueing.  The
+    writer always fills the slot readers aren't using, then bumps the sequence counter, so
+    the current frame is in slot (sequence & 1).  Readers check the sequence again after
+    reading, and retry if the frame changed underneath them.
+    """
+    # header slots
+    SEQUENCE = 0  # number of frames published so far
+    TIME_NS = 1  # monotonic time the current frame was published, in nanoseconds
+    FRAME_SIZE = 2  # size of a frame in bytes
+    HEADER_SLOTS = 8
+    HEADER_SIZE = HEADER_SLOTS * 8
+
+    # number of times read() will retry before giving up on a busy writer
+    MAX_READ_RETRIES = 4
+
+    def __init__(self, size: int = 0, name: str = None):
+        """
+        Create a new frame store, or attach to an existing one.
+        :param size: frame size in bytes.  Ignored when attaching, since the store knows its own size.
+        :param name: name of the shared memory block to attach to, or None to create a new one
+        """
+        self.owner = name is None
+        if self.owner:
+            size = max(1, size)
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + 2 * size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray(self.HEADER_SLOTS, dtype=np.int64, buffer=self.shm.buf)
+        if self.owner:
+            self.header[self.FRAME_SIZE] = size
+        self.size = int(self.header[self.FRAME_SIZE])
+        self.slots = np.ndarray((2, self.size), dtype=np.uint8, buffer=self.shm.buf, offset=self.HEADER_SIZE)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def sequence(self) -> int:
+        return int(self.header[self.SEQUENCE])
+
+    def publish(self, frame):
+        """
+        Store a new frame.  Only one process may publish to a store.
+        :param frame: frame data - a numpy array or any object supporting the buffer protocol
+        """
+        seq = self.header[self.SEQUENCE] + 1
+        src = np.frombuffer(frame, dtype=np.uint8)
+        n = min(len(src), self.size)
+        self.slots[seq & 1, :n] = src[:n]
+        self.header[self.TIME_NS] = time.monotonic_ns()
+        self.header[self.SEQUENCE] = seq
+
+    def latest(self):
+        """
+        Return the current frame without copying.  The view is only good 'till the writer
+        publishes twice more, which isCurrent() can check for.
+        :return: tuple of (sequence, frame view)
+        """
+        seq = self.sequence
+        return seq, self.slots[seq & 1]
+
+    def isCurrent(self, seq: int) -> bool:
+        """Returns True if a view returned by latest() with this sequence number is still intact"""
+        return self.sequence == seq
+
+    def read(self, out=None):
+        """
+        Return a consistent copy of the current frame.
+        :param out: optional uint8 array to copy the frame into
+        :return: tuple of (sequence, frame), or (sequence, None) if the writer was too busy
+        to get a consistent read.  Sequence 0 means no frame has been published yet.
+        """
+        if out is None:
+            out = np.empty(self.size, dtype=np.uint8)
+        for _ in range(self.MAX_READ_RETRIES):
+            seq, view = self.latest()
+            out[:] = view
+            if self.isCurrent(seq):
+                return seq, out
+        return self.sequence, None
+
+    def close(self):
+        """Detach from the shared memory block, and remove it if we created it."""
+        self.header = None
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a reader still holds a view from latest().  It'll be released when the process exits.
+            pass
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,178 @@
+"""
+ShowPlayer.py - Plays a recorded show (see ArtnetCapture.py) straight into the display
+devices, with no console and no network input, for unattended installations.
+
+Packets recorded at (nearly) the same time, or up to an ArtSync, are grouped into frames.
+A prefetch thread works ahead of playback: it reads upcoming frames out of the memory
+mapped capture, and looks up the device handlers for each packet, so all the playback
+thread has to do at a frame's deadline is hand the data to the handlers.  Deadlines are
+laid out ahead of time from the capture's timestamps, so timing errors don't accumulate,
+and playback sleeps until just before each deadline, then spins the rest of the way.
+"""
+import logging
+import mmap
+import queue
+import threading
+import time
+
+from ArtnetCapture import CapturePlayer
+
+
+class ShowFrame:
+    """A frame's worth of packets, ready to dispatch"""
+    __slots__ = ("time", "packets", "sync", "first")
+
+    def __init__(self, t: float, packets: list, sync: bool, first: bool):
+        self.time = t  # seconds since the start of the show, including earlier loops
+        self.packets = packets  # list of (fragment list from the dispatch table, data)
+        self.sync = sync  # True if the frame ended with an ArtSync
+        self.first = first  # True for the first frame of each pass through the show
+
+
+class ShowPlayer:
+    # packets less than this far apart (in ns) belong to the same frame
+    FRAME_WINDOW = 1000000
+
+    # number of frames the prefetch thread stays ahead of playback
+    PREFETCH_FRAMES = 64
+
+    # we sleep until this long (in seconds) before a frame's deadline, then spin
+    SPIN_MARGIN = 0.001
+
+    # a frame dispatched more than this late (in seconds) is counted as late
+    LATE_THRESHOLD = 0.002
+
+    def __init__(self, fileName: str, router, speed: float = 1.0, loop: bool = False):
+        """
+        :param fileName: capture file to play
+        :param router: the ArtnetRouter whose dispatch table and devices we feed
+        :param speed: playback speed.  1 is real time, 0 is as fast as possible
+        :param loop: if True, play the show over and over
+        """
+        self.capture = CapturePlayer(fileName)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.capture.dataMap.madvise(mmap.MADV_SEQUENTIAL)
+        self.router = router
+        self.speed = speed
+        self.loop = loop
+        self.frames = queue.Queue(maxsize=self.PREFETCH_FRAMES)
+        self.stopFlag = threading.Event()
+
+        # the gap between the end of the show and the start of the next loop, one mean
+        # frame interval, so looping doesn't stutter
+        syncs = self.capture.summary()["syncs"]
+        count = max(1, syncs if syncs > 0 else self.capture.count)
+        self.loopGap = self.capture.duration / count
+
+        # statistics
+        self.framesPlayed = 0
+        self.lateFrames = 0
+        self.maxLateMs = 0.0
+        self.loops = 0
+
+        self.prefetchThread = threading.Thread(target=self.prefetch, daemon=True)
+        self.playThread = threading.Thread(target=self.play, daemon=True)
+
+    def start(self):
+        logging.info("Playing %s (%.1f seconds, %d packets)%s" %
+                     (self.capture.fileName, self.capture.duration, self.capture.count,
+                      ", looping" if self.loop else ""))
+        self.prefetchThread.start()
+        self.playThread.start()
+
+    def stop(self):
+        self.stopFlag.set()
+        for thread in (self.prefetchThread, self.playThread):
+            if thread.is_alive():
+                thread.join()
+        self.capture.close()
+
+    def prefetch(self):
+        """
+        Read frames from the capture and queue them for playback, staying PREFETCH_FRAMES ahead.
+        Packet data is copied out of the capture here, so playback never waits on the disk.
+        """
+        c = self.capture
+        times, offsets, addrs, lengths = c.times, c.offsets, c.addrs, c.lengths
+        view = c.view
+        sync = c.SYNC_ADDRESS
+        base = 0.0
+
+        while c.count > 0 and not self.stopFlag.is_set():
+            i = 0
+            while i < c.count:
+                first = i == 0
+                # the dispatch table is looked up for each frame, so configuration changes
+                # take effect PREFETCH_FRAMES frames later, at most.
+                table = self.router.dispatchTable
+                start = times[i]
+                packets = []
+                synced = False
+                while i < c.count and times[i] - start < self.FRAME_WINDOW:
+                    addr = addrs[i]
+                    i += 1
+                    if addr == sync:
+                        synced = True
+                        break
+                    fragments = table.get(addr)
+                    if fragments is not None:
+                        packets.append((fragments, bytes(view[offsets[i - 1]:offsets[i - 1] + lengths[i - 1]])))
+                if not self.queueFrame(ShowFrame(base + start / 1e9, packets, synced, first)):
+                    return
+
+            if not self.loop:
+                break
+            base += c.duration + self.loopGap
+
+        # end of show marker
+        self.queueFrame(None)
+
+    def queueFrame(self, frame) -> bool:
+        """Wait for room in the queue, and add a frame.  Returns False if we were stopped while waiting."""
+        while not self.stopFlag.is_set():
+            try:
+                self.frames.put(frame, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def play(self):
+        """Dispatch each prefetched frame at its deadline"""
+        speed = self.speed
+        router = self.router
+        t0 = None
+
+        while not self.stopFlag.is_set():
+            try:
+                frame = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if frame is None:
+                logging.info("Show finished: %d frames, %d late" % (self.framesPlayed, self.lateFrames))
+                return
+            if frame.first and self.framesPlayed > 0:
+                self.loops += 1
+
+            if speed > 0:
+                if t0 is None:
+                    t0 = time.perf_counter() - frame.time / speed
+                deadline = t0 + frame.time / speed
+                d = deadline - time.perf_counter() - self.SPIN_MARGIN
+                if d > 0:
+                    self.stopFlag.wait(d)
+                while time.perf_counter() < deadline:
+                    time.sleep(0)
+                late = time.perf_counter() - deadline
+                if late > self.LATE_THRESHOLD:
+                    self.lateFrames += 1
+                self.maxLateMs = max(self.maxLateMs, late * 1000)
+
+            # stamp the frame as received now, for latency measurement, and hand it to the devices
+            router.receiveTime = time.perf_counter()
+            for fragments, data in frame.packets:
+                for handler, startChannel, destIndex, pixelCount, fragmentBit in fragments:
+                    handler(data, startChannel, destIndex, pixelCount, fragmentBit)
+            if frame.sync:
+                router.sync_dispatcher()
+            self.framesPlayed += 1
@@ -0,0 +1,160 @@
+"""
+SourceArbiter.py - Decides what to do when more than one controller sends the same universe.
+
+Policies:
+- "any": use whatever arrives, the way the router always has.
+- "failover": data from the primary source wins.  Other (backup) sources are ignored
+  on a universe until the primary has been silent on it for sourceTimeoutMs.
+- "htp": highest takes precedence.  Each channel gets the highest value any active source sends.
+- "ltp": latest takes precedence.  Each channel gets the value most recently changed by any source.
+
+Independent of the policy, packets from senders not on the allowedSources list (if there is
+one) are dropped before we do any work on them.
+
+Merging works on whole universes at a time with numpy, when it's available, so merging
+two sources costs about the same as decoding one.
+"""
+import time
+from enum import IntEnum
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class _Source:
+    """The most recent data from one source on one universe"""
+    __slots__ = ("data", "values", "length", "lastSeen")
+
+    def __init__(self):
+        self.data = bytearray(SourceArbiter.UNIVERSE_SIZE)
+        self.values = None if np is None else np.frombuffer(self.data, dtype=np.uint8)
+        self.length = 0
+        self.lastSeen = 0.0
+
+
+class _Universe:
+    """Per-universe merge state: each source's latest data, and the merged output"""
+    __slots__ = ("sources", "output", "outputValues", "outputView", "primarySeen", "onBackup")
+
+    def __init__(self):
+        self.sources = dict()
+        self.output = bytearray(SourceArbiter.UNIVERSE_SIZE)
+        self.outputValues = None if np is None else np.frombuffer(self.output, dtype=np.uint8)
+        self.outputView = memoryview(self.output)
+        self.primarySeen = -1.0e9
+        self.onBackup = False
+
+
+class SourceArbiter:
+    UNIVERSE_SIZE = 512
+
+    class Policies(IntEnum):
+        Any = 0
+        Failover = 1
+        Htp = 2
+        Ltp = 3
+
+    def __init__(self, policy: str = "any", allowedSources=(), primarySource: str = "", timeoutMs: int = 2500):
+        """
+        :param policy: "any", "failover", "htp" or "ltp"
+        :param allowedSources: IP addresses we accept data from.  Empty to accept any sender.
+        :param primarySource: IP address of the primary source, for the "failover" policy
+        :param timeoutMs: a source that hasn't sent data on a universe for this long is inactive
+        """
+        self.policy = {"failover": self.Policies.Failover, "htp": self.Policies.Htp,
+                       "ltp": self.Policies.Ltp}.get(policy, self.Policies.Any)
+        self.allowedSources = frozenset(allowedSources)
+        self.primarySource = primarySource
+        self.timeout = timeoutMs / 1000
+        self.universes = dict()
+
+        # counters, never reset
+        self.rejected = 0  # packets from senders that aren't allowed
+        self.ignored = 0  # backup packets ignored while the primary is active
+        self.failovers = 0  # times a universe switched to a backup source
+
+    def admit(self, addr: int, ip: str) -> bool:
+        """
+        Decide whether a packet should be processed at all.  Called before sequence checking,
+        so rejected packets cost as little as possible.
+        :param addr: Port-Address
+        :param ip: sender's IP address
+        :return: True to go ahead with the packet
+        """
+        if self.allowedSources and ip not in self.allowedSources:
+            self.rejected += 1
+            return False
+        if self.policy != self.Policies.Failover:
+            return True
+
+        u = self.universes.get(addr)
+        if u is None:
+            u = self.universes[addr] = _Universe()
+        now = time.monotonic()
+        if ip == self.primarySource:
+            u.primarySeen = now
+            u.onBackup = False
+            return True
+        if now - u.primarySeen < self.timeout:
+            self.ignored += 1
+            return False
+        if not u.onBackup:
+            u.onBackup = True
+            self.failovers += 1
+        return True
+
+    def merge(self, addr: int, ip: str, data):
+        """
+        Merge a packet's data with the data from any other active sources on its universe.
+        :param addr: Port-Address
+        :param ip: sender's IP address
+        :param data: DMX data
+        :return: the data to dispatch.  Merged data remains valid until the next packet on
+        the same universe is merged.
+        """
+        if self.policy < self.Policies.Htp:
+            return data
+
+        u = self.universes.get(addr)
+        if u is None:
+            u = self.universes[addr] = _Universe()
+        source = u.sources.get(ip)
+        if source is None:
+            source = u.sources[ip] = _Source()
+        now = time.monotonic()
+        n = min(len(data), self.UNIVERSE_SIZE)
+
+        if self.policy == self.Policies.Ltp:
+            # channels this source has changed since its last packet take its new values
+            if np is not None:
+                incoming = np.frombuffer(data, dtype=np.uint8, count=n)
+                changed = source.values[:n] != incoming
+                np.copyto(u.outputValues[:n], incoming, where=changed)
+            else:
+                old = source.data
+                out = u.output
+                for i in range(n):
+                    if data[i] != old[i]:
+                        out[i] = data[i]
+        source.data[:n] = data[:n]
+        if n < source.length:
+            source.data[n:source.length] = bytes(source.length - n)
+        source.length = n
+        source.lastSeen = now
+
+        active = [s for s in u.sources.values() if now - s.lastSeen < self.timeout]
+        if len(active) == 1:
+            # only one source, nothing to merge
+            return data
+
+        length = max(s.length for s in active)
+        if self.policy == self.Policies.Htp:
+            if np is not None:
+                np.maximum(active[0].values, active[1].values, out=u.outputValues)
+                for s in active[2:]:
+                    np.maximum(u.outputValues, s.values, out=u.outputValues)
+            else:
+                u.output[:] = bytes(map(max, *(s.data for s in active)))
+        return u.outputView[:length]
@@ -0,0 +1,166 @@
+"""
+StatsTable.py - A fixed-layout table of status information in shared memory.
+
+The Art-Net router writes each device's counters, frame rates and connection state
+into its own row once per status interval, and the web UI reads them directly, with no
+JSON, no pickling and no queue to fall behind.  Each row is guarded by its own sequence
+counter, which is odd while the row is being written, so readers can tell when they've
+caught a row mid-update and need to try again.
+"""
+import bisect
+import struct
+from multiprocessing import shared_memory
+
+
+class StatsTable:
+    """
+    Table header slots (float64), followed by one fixed size row per device.
+    """
+    GENERATION = 0  # incremented every time the router finishes updating the table
+    ROW_COUNT = 1  # number of rows in use
+    ROUTER_IN_PPS = 2  # router-wide receive statistics
+    ROUTER_BATCHES = 3
+    ROUTER_MEAN_BATCH = 4
+    ROUTER_MAX_BATCH = 5
+    ROUTER_BATCH_SIZES = 6  # batch size histogram, one slot per bucket in BATCH_BUCKETS
+    HEADER_SLOTS = 16
+    HEADER_SIZE = HEADER_SLOTS * 8
+
+    # smallest batch size in each bucket of the batch size histogram.  Each bucket holds the
+    # batches up to the next bucket's smallest size, and the last holds everything bigger.
+    BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+    # Row layout: numeric fields (float64), then fixed width, NUL padded UTF-8 text fields.
+    # Slot 0 of every row is the row's sequence counter.
+    ROW_SEQUENCE = 0
+    VALUE_FIELDS = ("inPps", "outFps", "lost", "stale", "skipped", "connected", "maxFps",
+                    "intervalMs", "jitterMs", "maxErrorMs", "missed",
+                    "latencyP50Ms", "latencyP95Ms", "latencyP99Ms", "decodeP99Ms")
+    INT_FIELDS = ("lost", "stale", "skipped", "missed")
+    VALUE_SLOTS = 24
+    TEXT_FIELDS = (("name", 64), ("ip", 64), ("lastError", 128))
+    ROW_SIZE = VALUE_SLOTS * 8 + sum(n for _, n in TEXT_FIELDS)
+
+    # number of times readRow() will retry before giving up on a busy writer
+    MAX_READ_RETRIES = 4
+
+    def __init__(self, capacity: int = 0, name: str = None):
+        """
+        Create a new stats table, or attach to an existing one.
+        :param capacity: maximum number of rows.  Ignored when attaching.
+        :param name: name of the shared memory block to attach to, or None to create a new one
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + max(1, capacity) * self.ROW_SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.capacity = (self.shm.size - self.HEADER_SIZE) // self.ROW_SIZE
+        self.header = self.shm.buf[:self.HEADER_SIZE].cast('d')
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def generation(self) -> int:
+        return int(self.header[self.GENERATION])
+
+    def _rowOffset(self, row: int) -> int:
+        return self.HEADER_SIZE + row * self.ROW_SIZE
+
+    def writeRow(self, row: int, status: dict):
+        """
+        Write a device's status to the table.  Only one process may write to a table.
+        :param row: row index
+        :param status: device status dictionary, as returned by DisplayDevice.getStatus()
+        """
+        if row >= self.capacity:
+            return
+        offset = self._rowOffset(row)
+        values = self.shm.buf[offset:offset + self.VALUE_SLOTS * 8].cast('d')
+
+        values[self.ROW_SEQUENCE] += 1
+        for i, field in enumerate(self.VALUE_FIELDS, 1):
+            value = status.get(field, 0)
+            # connection state arrives as a "true"/"false" string
+            values[i] = float(value == "true") if isinstance(value, str) else float(value)
+        offset += self.VALUE_SLOTS * 8
+        for field, width in self.TEXT_FIELDS:
+            text = str(status.get(field, "")).encode("utf-8")[:width]
+            self.shm.buf[offset:offset + width] = text.ljust(width, b'\x00')
+            offset += width
+        values[self.ROW_SEQUENCE] += 1
+        values.release()
+
+    def readRow(self, row: int):
+        """
+        Read a consistent copy of a device's status.
+        :param row: row index
+        :return: status dictionary, or None if the writer was too busy to get a consistent read
+        """
+        offset = self._rowOffset(row)
+        for _ in range(self.MAX_READ_RETRIES):
+            raw = bytes(self.shm.buf[offset:offset + self.ROW_SIZE])
+            if (struct.unpack_from('d', raw)[0] % 2) == 0 and \
+                    bytes(self.shm.buf[offset:offset + 8]) == raw[:8]:
+                break
+        else:
+            return None
+
+        values = struct.unpack_from('%dd' % self.VALUE_SLOTS, raw)
+        status = {field: values[i] for i, field in enumerate(self.VALUE_FIELDS, 1)}
+        for field in self.INT_FIELDS:
+            status[field] = int(status[field])
+        status["connected"] = "true" if status["connected"] else "false"
+        pos = self.VALUE_SLOTS * 8
+        for field, width in self.TEXT_FIELDS:
+            status[field] = raw[pos:pos + width].rstrip(b'\x00').decode("utf-8", errors="replace")
+            pos += width
+        return status
+
+    def readRows(self) -> list:
+        """Return status dictionaries for all rows in use, skipping any we couldn't read"""
+        rows = (self.readRow(n) for n in range(min(int(self.header[self.ROW_COUNT]), self.capacity)))
+        return [status for status in rows if status is not None]
+
+    def setRouterStatus(self, status: dict):
+        """
+        Write the router's receive statistics to the table header
+        :param status: router status dictionary, as returned by ArtnetRouter.getRouterStatus()
+        """
+        self.header[self.ROUTER_IN_PPS] = status["inPps"]
+        self.header[self.ROUTER_BATCHES] = status["batches"]
+        self.header[self.ROUTER_MEAN_BATCH] = status["meanBatch"]
+        self.header[self.ROUTER_MAX_BATCH] = status["maxBatch"]
+
+        counts = [0] * len(self.BATCH_BUCKETS)
+        for n, count in status["batchSizes"].items():
+            counts[bisect.bisect_right(self.BATCH_BUCKETS, n) - 1] += count
+        for i, count in enumerate(counts):
+            self.header[self.ROUTER_BATCH_SIZES + i] = count
+
+    def getRouterStatus(self) -> dict:
+        """
+        Return the router's receive statistics.  "batchSizes" is the batch size histogram, as
+        {bucket name: number of batches}, where bucket names are like "4-7", or "64+" for the last.
+        """
+        h = self.header
+        buckets = self.BATCH_BUCKETS
+        names = ["%d" % lo if hi == lo + 1 else "%d-%d" % (lo, hi - 1) for lo, hi in zip(buckets, buckets[1:])]
+        names.append("%d+" % buckets[-1])
+        return {"inPps": h[self.ROUTER_IN_PPS], "batches": int(h[self.ROUTER_BATCHES]),
+                "meanBatch": h[self.ROUTER_MEAN_BATCH], "maxBatch": int(h[self.ROUTER_MAX_BATCH]),
+                "batchSizes": {name: int(h[self.ROUTER_BATCH_SIZES + i]) for i, name in enumerate(names)}}
+
+    def publish(self, rowCount: int):
+        """Mark the table as completely updated, with the given number of rows in use"""
+        self.header[self.ROW_COUNT] = min(rowCount, self.capacity)
+        self.header[self.GENERATION] += 1
+
+    def close(self):
+        """Detach from the shared memory block, and remove it if we created it."""
+        self.header.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
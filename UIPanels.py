@@ -63,13 +63,13 @@ class StatusContainer(Container):
         title.style['font-size'] = '110%'
         self.append(title, 'title')
 
-        table = TableWidget(4, 5, True, False, width="100%", height="100%")
+        table = TableWidget(4, 8, True, False, width="100%", height="100%")
         table.style['position'] = "absolute"
         table.style['overflow'] = "auto"
         table.style['left'] = "0px"
         table.style['top'] = "50px"
 
-        for n in range(5):
+        for n in range(8):
             table.item_at(0, n).style['height'] = uiTextHeight
 
         table.item_at(0, 0).set_text("Name")
@@ -77,9 +77,28 @@ class StatusContainer(Container):
         table.item_at(0, 2).set_text("PPS in")
         table.item_at(0, 3).set_text("FPS out")
         table.item_at(0, 4).set_text("Connected")
+        table.item_at(0, 5).set_text("Lost/Stale")
+        table.item_at(0, 6).set_text("Jitter ms")
+        table.item_at(0, 7).set_text("Latency ms 50/95/99%")
 
         self.append(table, 'status_table')
 
+        # router-wide receive statistics
+        routerStatus = Label("")
+        routerStatus.style['position'] = "absolute"
+        routerStatus.style['left'] = "8em"
+        routerStatus.style['top'] = "4px"
+        self.append(routerStatus, 'router_status')
+
+    def set_router_status(self, data: dict):
+        # batch size distribution, as the percentage of batches in each (non-empty) size bucket
+        batches = data.get('batches', 0)
+        sizes = "  ".join("%s: %d%%" % (name, round(100 * count / batches))
+                          for name, count in data.get('batchSizes', {}).items() if count > 0)
+        self.get_child('router_status').set_text(
+            "In: %s pps   Batch avg: %s  max: %s   %s" % (data.get('inPps', 0), data.get('meanBatch', 0),
+                                                          data.get('maxBatch', 0), sizes))
+
 
 class SystemSettingsContainer(Container):
     def __init__(self, **kwargs):
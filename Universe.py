@@ -9,12 +9,14 @@ class UniverseFragment:
     startIndex - starting index in input pixel buffer
     destIndex  - destination index in output pixel buffer
     pixelCount - number of pixels to be copied
+    fragmentBit - bit identifying this fragment in its device's frame tracking mask
     """
     device = None
     address_mask = 0
     startChannel = 0
     destIndex = 0
     pixelCount = 0
+    fragmentBit = 0
 
     def __init__(self, device, record):
         self.device = device
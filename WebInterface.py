@@ -1,10 +1,9 @@
-import json
 
 from remi import App
 from remi.server import Server
 
 from ArtnetUtils import clamp, artnet_to_int
-from ProcessManager import restartArtnetRouter
+from ProcessManager import reconfigureArtnetRouter, restartArtnetRouter
 from UIPanels import *
 
 pd: ProjectData
@@ -88,6 +87,8 @@ class Flamecaster(App):
     systemPanel = None
     devicesPanel = None
     universesPanel = None
+    statsTable = None
+    statsGeneration = -1
 
     def __init__(self, *args):
         super(Flamecaster, self).__init__(*args)
@@ -99,21 +100,32 @@ class Flamecaster(App):
         # start receiving status updates from the Artnet router
         if not pd.ui_is_active.is_set():
             pd.ui_is_active.set()
-        if not pd.dataQueue.empty():
-            # read the JSON status strings from the queue
-            msg = json.loads(pd.dataQueue.get())
-            # if top level key is "name", it's a device status message
-            if 'name' in msg:
-                # update the device dictionary with the new status
-                self.devices[msg['name']] = msg
-
-            # reconfigure the status table for the updated device list
-            # leave the top row for labels.  The bottom row is blank
-            # because it will expand to fill any remaining space in the
-            #
-            self.status_table.set_row_count(3 + len(self.devices))
-            self.fill_status_table()
-            self.status_table.redraw()
+
+        # (re)attach to the router's status table if it has changed since we last looked
+        if self.statsTable is None or self.statsTable.name != pd.statsTableName:
+            if self.statsTable is not None:
+                self.statsTable.close()
+            self.statsTable = pd.attachStatsTable()
+            self.statsGeneration = -1
+            if self.statsTable is None:
+                return
+
+        # nothing to do unless the router has updated the table since we last read it
+        generation = self.statsTable.generation
+        if generation == self.statsGeneration:
+            return
+        self.statsGeneration = generation
+
+        self.devices = {status['name']: status for status in self.statsTable.readRows()}
+        self.statusPanel.set_router_status(self.statsTable.getRouterStatus())
+
+        # reconfigure the status table for the updated device list
+        # leave the top row for labels.  The bottom row is blank
+        # because it will expand to fill any remaining space in the
+        #
+        self.status_table.set_row_count(3 + len(self.devices))
+        self.fill_status_table()
+        self.status_table.redraw()
 
     def main(self):
 
@@ -261,10 +273,11 @@ class Flamecaster(App):
         return decode_address_int(highestUniverse + 1)
 
     def on_close(self):
-        # deactivate the UI flag and empty the data queue
+        # deactivate the UI flag and let go of the status table
         pd.ui_is_active.clear()
-        while not pd.dataQueue.empty():
-            pd.dataQueue.get()
+        if self.statsTable is not None:
+            self.statsTable.close()
+            self.statsTable = None
 
         super(Flamecaster, self).on_close()
 
@@ -353,7 +366,7 @@ class Flamecaster(App):
         """
 
         lastRow = 2 + len(self.devices)
-        for n in range(5):
+        for n in range(8):
             self.status_table.item_at(0, n).style['height'] = uiTextHeight
             self.status_table.item_at(lastRow, n).set_text("  ")
 
@@ -373,8 +386,14 @@ class Flamecaster(App):
             else:
                 self.status_table.item_at(i, 4).css_color = "rgb(255,0,0)"
                 self.status_table.item_at(i, 4).set_text("No")
+            self.status_table.item_at(i, 4).attributes['title'] = db.get('lastError', '')
+
+            self.status_table.item_at(i, 5).set_text("%s/%s" % (db.get('lost', 0), db.get('stale', 0)))
+            self.status_table.item_at(i, 6).set_text(str(db.get('jitterMs', 0)))
+            self.status_table.item_at(i, 7).set_text("%s/%s/%s" % (db.get('latencyP50Ms', 0), db.get('latencyP95Ms', 0),
+                                                                   db.get('latencyP99Ms', 0)))
 
-            for n in range(5):
+            for n in range(8):
                 self.status_table.item_at(i, n).style['height'] = uiTextHeight
 
     def start_universe_editor(self):
@@ -553,7 +572,7 @@ class Flamecaster(App):
 
     def menu_save_clicked(self, emitter):
         pd.saveProject()
-        restartArtnetRouter(pd)
+        reconfigureArtnetRouter(pd, pd.editableConfig)
         pass
 
     def menu_reload_clicked(self, emitter):
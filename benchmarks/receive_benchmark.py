@@ -0,0 +1,86 @@
+"""
+receive_benchmark.py - Measures how many Art-Net packets per second ArtnetServer can
+receive and hand to its callback, with and without zero-copy receive.
+
+A separate sender process floods the server with ArtDmx packets over loopback for a
+fixed time, and we count the packets that make it through to the callback.
+
+Usage: python benchmarks/receive_benchmark.py [--seconds 3] [--port 6460]
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+from multiprocessing import Event, Process
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ArtnetServer import ArtnetServer
+
+
+def make_artdmx_packet(addr: int, sequence: int = 0) -> bytes:
+    """Build a full-size (512 channel) ArtDmx packet for the given 15-bit Port-Address."""
+    header = b'Art-Net\x00' + (0x5000).to_bytes(2, byteorder='little') + (14).to_bytes(2, byteorder='big')
+    return (header + bytes((sequence, 0)) + addr.to_bytes(2, byteorder='little') +
+            (512).to_bytes(2, byteorder='big') + bytes(range(256)) * 2)
+
+
+def sender(port: int, stop: Event):
+    """Send ArtDmx packets on 16 universes as fast as possible until told to stop."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = [make_artdmx_packet(u) for u in range(16)]
+    while not stop.is_set():
+        for p in packets:
+            try:
+                sock.sendto(p, ("127.0.0.1", port))
+            except OSError:
+                pass
+    sock.close()
+
+
+def run(zeroCopy: bool, seconds: float, port: int) -> float:
+    """Run one receive test and return the received packets/sec."""
+    touched = 0
+
+    def callback(addr, data):
+        # touch the data, like a real packet handler would
+        nonlocal touched
+        touched += data[0]
+
+    server = ArtnetServer("127.0.0.1", port, b'', callback, zeroCopy=zeroCopy)
+    time.sleep(0.2)
+
+    stop = Event()
+    p = Process(target=sender, args=(port, stop), daemon=True)
+    p.start()
+
+    # let things settle, then count packets for the test period
+    time.sleep(0.5)
+    start_count = server.packetCount
+    t = time.perf_counter()
+    time.sleep(seconds)
+    received = server.packetCount - start_count
+    elapsed = time.perf_counter() - t
+
+    stop.set()
+    p.join()
+    server.close()
+    return received / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of each test run in seconds")
+    parser.add_argument("--port", type=int, default=6460, help="UDP port to use on 127.0.0.1")
+    args = parser.parse_args()
+
+    before = run(False, args.seconds, args.port)
+    print("recvfrom + copy:         %10.0f packets/sec" % before)
+    after = run(True, args.seconds, args.port)
+    print("recvfrom_into zero-copy: %10.0f packets/sec" % after)
+    print("speedup:                 %10.2fx" % (after / before if before > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+router_benchmark.py - Measures how much Art-Net traffic Flamecaster can sustain, end to end.
+
+A synthetic Art-Net source sends a configurable number of universes at a given frame
+rate over loopback, and a set of emulated Pixelblazes (see PixelblazeEmulator.py)
+receive the output.  The benchmark runs in two phases:
+
+- In-process: packets are pushed straight through a dispatch table to measure
+  dispatch time per packet, and frames are sent to the emulators to measure
+  the time to encode and send a frame.
+- End to end: the real ArtnetRouter process is started on a generated configuration,
+  and we measure receive rate, outbound frame rate and latency per device, and router
+  CPU usage.
+
+Before either phase, the numpy and per-pixel pixel packers are checked against each other.
+
+Results are printed (or written) as JSON, so they can be compared from run to run.
+
+Usage: python benchmarks/router_benchmark.py [--universes 16] [--fps 40] [--pattern even|burst]
+            [--protocol artnet|sacn] [--devices 4] [--delay-ms 0] [--bandwidth-kbps 0]
+            [--drop-interval 0] [--seconds 5] [--capture session.fcap] [--capture-speed 1]
+            [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from multiprocessing import Event, Process, Value
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ArtnetCapture import CapturePlayer
+from ConfigParser import ConfigParser
+from DisplayDevice import DisplayDevice, np
+from PixelblazeEmulator import startEmulators
+from ProjectData import ProjectData
+import ProcessManager
+
+
+def make_artdmx_packet(addr: int, sequence: int, data: bytes) -> bytes:
+    """Build an ArtDmx packet for the given 15-bit Port-Address."""
+    header = b'Art-Net\x00' + (0x5000).to_bytes(2, byteorder='little') + (14).to_bytes(2, byteorder='big')
+    return (header + bytes((sequence, 0)) + addr.to_bytes(2, byteorder='little') +
+            len(data).to_bytes(2, byteorder='big') + data)
+
+
+def make_artsync_packet() -> bytes:
+    return b'Art-Net\x00' + (0x5200).to_bytes(2, byteorder='little') + (14).to_bytes(2, byteorder='big') + b'\x00\x00'
+
+
+SACN_CID = bytes(range(16))
+
+
+def make_sacn_packet(universe: int, sequence: int, data: bytes, priority: int = 100) -> bytes:
+    """Build an E1.31 data packet for the given sACN universe."""
+    n = len(data) + 1
+    root = (b'\x00\x10\x00\x00ASC-E1.17\x00\x00\x00' + (0x7000 | (n + 109)).to_bytes(2, byteorder='big') +
+            (4).to_bytes(4, byteorder='big') + SACN_CID)
+    framing = ((0x7000 | (n + 87)).to_bytes(2, byteorder='big') + (2).to_bytes(4, byteorder='big') +
+               b'router_benchmark'.ljust(64, b'\x00') + bytes((priority, 0, 0, sequence, 0)) +
+               universe.to_bytes(2, byteorder='big'))
+    dmp = ((0x7000 | (n + 10)).to_bytes(2, byteorder='big') + b'\x02\xa1\x00\x00\x00\x01' +
+           n.to_bytes(2, byteorder='big') + b'\x00' + data)
+    return root + framing + dmp
+
+
+def make_sacn_sync_packet(sequence: int, syncUniverse: int = 1) -> bytes:
+    """Build an E1.31 synchronization packet"""
+    return (b'\x00\x10\x00\x00ASC-E1.17\x00\x00\x00' + (0x7000 | 33).to_bytes(2, byteorder='big') +
+            (8).to_bytes(4, byteorder='big') + SACN_CID + (0x7000 | 11).to_bytes(2, byteorder='big') +
+            (1).to_bytes(4, byteorder='big') + bytes((sequence,)) + syncUniverse.to_bytes(2, byteorder='big') +
+            b'\x00\x00')
+
+
+def generator(port: int, universes: int, fps: float, pattern: str, sync: bool, stop: Event, sent: Value,
+              protocol: str = "artnet"):
+    """
+    Synthetic Art-Net (or sACN) source.  Sends frames of full (510 channel) universes at the given frame rate.
+    :param pattern: "even" spreads a frame's packets evenly over the frame period, "burst" sends them
+    back to back at the start of the frame.
+    :param sync: if True, send an ArtSync (or sACN synchronization) packet after each frame
+    :param protocol: "artnet", or "sacn" to send unicast sACN to port 5568.  sACN universe n + 1
+    carries Art-Net universe n's data.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sacn = protocol == "sacn"
+    dest = ("127.0.0.1", 5568 if sacn else port)
+
+    # a few different frames of data, so repeated frames don't get skipped
+    payloads = [bytes((i + f * 37) & 255 for i in range(510)) for f in range(4)]
+    syncPacket = make_artsync_packet()
+    period = 1 / fps
+    spacing = period / universes if pattern == "even" else 0
+    deadline = time.monotonic()
+    frame = 0
+    count = 0
+
+    while not stop.is_set():
+        seq = frame % 255 + 1
+        data = payloads[frame % len(payloads)]
+        for u in range(universes):
+            if spacing > 0:
+                d = deadline + u * spacing - time.monotonic()
+                if d > 0:
+                    time.sleep(d)
+            try:
+                if sacn:
+                    sock.sendto(make_sacn_packet(u + 1, seq, data), dest)
+                else:
+                    sock.sendto(make_artdmx_packet(u, seq, data), dest)
+                count += 1
+            except OSError:
+                pass
+        if sync:
+            sock.sendto(make_sacn_sync_packet(seq) if sacn else syncPacket, dest)
+
+        frame += 1
+        deadline += period
+        d = deadline - time.monotonic()
+        if d > 0:
+            time.sleep(d)
+        else:
+            # can't keep up - don't try to make up the missed frames
+            deadline = time.monotonic()
+
+        with sent.get_lock():
+            sent.value = count
+    sock.close()
+
+
+def capture_generator(port: int, fileName: str, speed: float, stop: Event, sent: Value):
+    """
+    Art-Net source that replays a capture file (see ArtnetCapture.py), looping at the end.
+    :param speed: playback speed.  1 is real time, 0 is as fast as possible
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dest = ("127.0.0.1", port)
+    sequence = dict()
+    syncPacket = make_artsync_packet()
+    count = [0]
+
+    def send(addr, data):
+        seq = sequence.get(addr, 0) % 255 + 1
+        sequence[addr] = seq
+        try:
+            sock.sendto(make_artdmx_packet(addr, seq, bytes(data)), dest)
+        except OSError:
+            pass
+        count[0] += 1
+        if count[0] % 64 == 0:
+            sent.value = count[0]
+
+    player = CapturePlayer(fileName)
+    player.play(send, lambda: sock.sendto(syncPacket, dest), speed=speed, loop=True, stopFlag=stop)
+    sent.value = count[0]
+    player.close()
+    sock.close()
+
+
+def build_config(args, servers: list) -> dict:
+    """Generate a configuration that spreads the universes evenly over the devices"""
+    config = {"system": {"statusUpdateIntervalMs": 1000, "portArtnet": args.port, "ipArtnet": "127.0.0.1",
+                         "maxFps": args.max_fps, "receiveMode": args.receive_mode,
+                         "outputEngine": args.output_engine, "sacnEnabled": args.protocol == "sacn"},
+              "devices": dict()}
+    ConfigParser.setSystemDefaults(config)
+    perDevice = max(1, args.universes // len(servers))
+    for n, server in enumerate(servers):
+        data = dict()
+        for i in range(perDevice):
+            data[str(i)] = {"net": 0, "subnet": 0, "universe": n * perDevice + i,
+                            "startChannel": 0, "destIndex": i * 170, "pixelCount": 170}
+        config["devices"]["pb%d" % n] = {"name": server.name, "ip": server.address,
+                                         "pixelCount": server.pixelCount, "maxFps": args.max_fps,
+                                         "data": data}
+    return config
+
+
+def measure_dispatch(config: dict, packets: int = 20000, captureFile: str = None) -> dict:
+    """
+    Push packets through a dispatch table, without any networking, and time it.  With a capture
+    file, the capture's packets are used, in order, instead of synthetic ones.
+    """
+    parser = ConfigParser()
+    _, deviceList, _, table = parser.parse(config, startOutput=False)
+    if captureFile:
+        player = CapturePlayer(captureFile)
+        workload = [(addr, bytearray(data)) for _, addr, data in (player.packet(i) for i in range(player.count))
+                    if addr in table]
+        player.close()
+    else:
+        payload = bytearray(range(255)) * 2
+        workload = [(addr, payload) for addr in sorted(table)]
+
+    t = time.perf_counter()
+    for i in range(packets):
+        addr, payload = workload[i % len(workload)]
+        for handler, startChannel, destIndex, pixelCount, fragmentBit in table[addr]:
+            handler(payload, startChannel, destIndex, pixelCount, fragmentBit)
+    elapsed = time.perf_counter() - t
+
+    for key in deviceList:
+        deviceList[key].stop()
+    return {"packets": packets, "meanUs": round(elapsed / packets * 1e6, 2),
+            "pixelsPerSec": round(packets * 170 / elapsed)}
+
+
+def measure_encode(config: dict, frames: int = 200) -> dict:
+    """Time encoding and sending frames to the emulated Pixelblazes, one device at a time"""
+    parser = ConfigParser()
+    _, deviceList, _, table = parser.parse(config, startOutput=False)
+    payloads = [bytearray((i + f * 37) & 255 for i in range(510)) for f in range(2)]
+    results = []
+
+    for key in deviceList:
+        dd = deviceList[key]
+        dd.connect()
+        if dd.pb is None or not dd.pb.is_connected():
+            results.append({"name": dd.name, "error": "could not connect"})
+            continue
+        dd.sendMethod()  # connection setup
+
+        elapsed = 0.0
+        for f in range(frames):
+            for addr in sorted(dd.addresses):
+                for handler, startChannel, destIndex, pixelCount, fragmentBit in table[addr]:
+                    if handler.__self__ is dd:
+                        handler(payloads[f % 2], startChannel, destIndex, pixelCount, fragmentBit)
+            t = time.perf_counter()
+            dd.sendMethod()
+            elapsed += time.perf_counter() - t
+        results.append({"name": dd.name, "pixels": dd.pixelCount, "meanMs": round(elapsed / frames * 1000, 3)})
+        dd.stop()
+    return {"frames": frames, "devices": results}
+
+
+def check_pixel_parity() -> dict:
+    """
+    Pack colors with both the numpy and the per-pixel pixel packers, and count the colors they
+    disagree on.  Covers every red and blue value, with the green values around the sign and
+    rounding boundaries.
+    """
+    if np is None:
+        return {"error": "numpy not available"}
+    dd = DisplayDevice({"name": "parity", "pixelCount": 256}, {"maxFps": 30}, startOutput=False)
+    colors = mismatches = 0
+    for r in range(256):
+        for g in (0, 1, 127, 128, 254, 255):
+            payload = bytearray()
+            for b in range(256):
+                payload += bytes((r, g, b))
+            dd.process_pixel_data_np(payload, 0, 0, 256)
+            vectorized = dd.pixels.copy()
+            dd.process_pixel_data(payload, 0, 0, 256)
+            mismatches += int(np.count_nonzero(vectorized != dd.pixels))
+            colors += 256
+    return {"colors": colors, "mismatches": mismatches}
+
+
+def cpu_seconds(pid: int):
+    """Return user + system CPU time used by a process, or None if we can't tell on this platform"""
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def measure_end_to_end(args, config: dict, servers: list) -> dict:
+    """Run the real router process against the synthetic source and emulated Pixelblazes"""
+    pd = ProjectData()
+    pd.liveConfig = config
+    ProcessManager.startArtnetRouter(pd)
+
+    stop = Event()
+    sent = Value('q', 0)
+    if args.capture:
+        gen = Process(target=capture_generator, args=(args.port, args.capture, args.capture_speed, stop, sent),
+                      daemon=True)
+    else:
+        gen = Process(target=generator, args=(args.port, args.universes, args.fps, args.pattern, args.sync, stop,
+                                              sent, args.protocol), daemon=True)
+    gen.start()
+
+    # let connections settle, then measure
+    time.sleep(2)
+    cpu0 = cpu_seconds(pd.routerProcess.pid)
+    sent0 = sent.value
+    frames0 = [s.frames for s in servers]
+    drops0 = [s.drops for s in servers]
+    t = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - t
+    cpu1 = cpu_seconds(pd.routerProcess.pid)
+    sentPackets = sent.value - sent0
+    frames = [s.frames - f for s, f in zip(servers, frames0)]
+    drops = [s.drops - d for s, d in zip(servers, drops0)]
+
+    # the router's own view, from its last status update
+    table = ProcessManager.statsTable
+    rows = {row['name']: row for row in table.readRows()}
+    router = table.getRouterStatus()
+
+    stop.set()
+    gen.join()
+    ProcessManager.stopArtnetRouter(pd)
+
+    return {"seconds": round(elapsed, 2),
+            "sentPps": round(sentPackets / elapsed, 1),
+            "receivedPps": router["inPps"],
+            "meanBatch": router["meanBatch"],
+            "batchSizes": router["batchSizes"],
+            "routerCpuPercent": None if cpu0 is None or cpu1 is None else round((cpu1 - cpu0) / elapsed * 100, 1),
+            "devices": [{"name": s.name, "outFps": round(n / elapsed, 1),
+                         "inPps": rows.get(s.name, {}).get("inPps"),
+                         "lost": rows.get(s.name, {}).get("lost"),
+                         "latencyP50Ms": rows.get(s.name, {}).get("latencyP50Ms"),
+                         "latencyP95Ms": rows.get(s.name, {}).get("latencyP95Ms"),
+                         "latencyP99Ms": rows.get(s.name, {}).get("latencyP99Ms"),
+                         "drops": d} for s, n, d in zip(servers, frames, drops)]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--universes", type=int, default=16, help="Number of universes to send")
+    parser.add_argument("--fps", type=float, default=40, help="Art-Net frames per second to send")
+    parser.add_argument("--pattern", choices=("even", "burst"), default="even",
+                        help="Spread each frame's packets evenly over the frame, or send them in a burst")
+    parser.add_argument("--sync", action="store_true", help="Send ArtSync after each frame")
+    parser.add_argument("--protocol", choices=("artnet", "sacn"), default="artnet",
+                        help="Send Art-Net, or unicast sACN (E1.31) on port 5568")
+    parser.add_argument("--devices", type=int, default=4, help="Number of emulated Pixelblazes")
+    parser.add_argument("--max-fps", type=int, default=30, help="Device output frame rate limit")
+    parser.add_argument("--receive-mode", default="batch", help="Router receive mode (simple, zerocopy, batch)")
+    parser.add_argument("--output-engine", default="threads", help="Router output engine (threads, asyncio)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Length of the end to end test in seconds")
+    parser.add_argument("--port", type=int, default=6470, help="Art-Net UDP port to use on 127.0.0.1")
+    parser.add_argument("--ws-port", type=int, default=18100, help="First TCP port for the emulated Pixelblazes")
+    parser.add_argument("--delay-ms", type=float, default=0, help="Emulated Pixelblaze processing delay per frame")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0,
+                        help="Emulated Pixelblaze receive bandwidth limit, 0 for none")
+    parser.add_argument("--drop-interval", type=float, default=0,
+                        help="Emulated Pixelblazes drop their connections after this many seconds, 0 to never drop")
+    parser.add_argument("--capture", help="Replay this capture file (see ArtnetCapture.py) instead of sending "
+                                          "synthetic data.  Its Port-Addresses set the number of universes")
+    parser.add_argument("--capture-speed", type=float, default=1.0,
+                        help="Capture replay speed, 1 for real time, 0 for as fast as possible")
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.capture:
+        player = CapturePlayer(args.capture)
+        args.universes = max((int(addr) for addr in player.summary()["addresses"]), default=0) + 1
+        player.close()
+
+    servers = startEmulators(args.devices, args.ws_port, 170 * max(1, args.universes // args.devices),
+                             processingDelayMs=args.delay_ms, bandwidthKbps=args.bandwidth_kbps,
+                             dropInterval=args.drop_interval)
+    config = build_config(args, servers)
+
+    results = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "settings": {k: v for k, v in vars(args).items() if k != "output"},
+               "pixelParity": check_pixel_parity(),
+               "dispatch": measure_dispatch(config, captureFile=args.capture),
+               "encode": measure_encode(config),
+               "endToEnd": measure_end_to_end(args, config, servers)}
+
+    for s in servers:
+        s.close()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
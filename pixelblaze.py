@@ -76,7 +76,7 @@ class Pixelblaze:
 
         Args:
             ipAddress (str): The Pixelblaze's IPv4 address in the usual dotted-quads numeric format
-             (for example, "192.168.4.1").
+             (for example, "192.168.4.1"), optionally followed by a port (for example, "127.0.0.1:8181").
         """
         self.ipAddress = ipAddress
         self.setCacheRefreshTime(600)  # seconds used in public api
@@ -122,7 +122,8 @@ class Pixelblaze:
         # only retry opens every 2 seconds at most
         if time_in_millis() - self.lastOpenAttempt > self.default_open_interval:
             self.lastOpenAttempt = time_in_millis()
-            uri = "ws://" + self.ipAddress + ":81"
+            # the address may include a port, for emulated Pixelblazes on a test machine
+            uri = "ws://" + self.ipAddress + ("" if ":" in self.ipAddress else ":81")
 
             try:
                 self.ws = websocket.create_connection(uri, skip_utf8_validation=True, sockopt=(